@@ -3,10 +3,10 @@ from src.automata_util import *
 
 if __name__ == '__main__':
     nd = NDAutomata()
-    nd.add_word("auto", lambda: print("lul"))
-    nd.add_word("automovil", lambda: print("lula"))
-    nd.add_word("autobus", lambda: print("lulaaaa"))
-    nd.add_word("casa", lambda: print("casa"))
+    words = ["auto", "automovil", "autobus", "casa"]
+    for word_id, word in enumerate(words):
+        nd.add_word(word, word_id)
+    nd.reached_call = lambda word_ids: print([words[word_id] for word_id in word_ids])
     da = determinize_automata(nd)
     print("nd: ")
     nd.consume_stream("<html>")
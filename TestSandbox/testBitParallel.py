@@ -0,0 +1,37 @@
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from automata_util import *
+
+TRIALS = 3000
+WORD_CHARS = 'ab<.x'
+TEXT_CHARS = 'abAB .,\n<>x'
+
+
+def find_in_chunks(automata, chunks):
+    # the NFA reports the words ending on the same char in no particular order
+    found = []
+    offset = 0
+    for chunk in chunks:
+        found.extend((offset + position, sorted(word_ids)) for position, word_ids in automata.find_stream(chunk))
+        offset += len(chunk)
+    return sorted(found)
+
+
+if __name__ == '__main__':
+    generator = random.Random(1)
+    for trial in range(TRIALS):
+        words = {''.join(generator.choice(WORD_CHARS) for _ in range(generator.randint(1, 3)))
+                 for _ in range(generator.randint(1, 5))}
+        nd = NDAutomata()
+        for word_id, word in enumerate(sorted(words)):
+            nd.add_word(word, word_id)
+        bit_parallel = bit_parallel_automata(nd)
+        text = ''.join(generator.choice(TEXT_CHARS) for _ in range(generator.randint(0, 40))) + ENTER
+        cut = generator.randint(0, len(text))
+        expected = find_in_chunks(nd, [text])
+        assert find_in_chunks(bit_parallel, [text[:cut], text[cut:]]) == expected, (words, text, cut)
+    print("{} random texts found the same words with the NFA and the bit-parallel engine".format(TRIALS))
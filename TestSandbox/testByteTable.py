@@ -0,0 +1,46 @@
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from automata_util import *
+from file_util import translate_newlines
+from tpe import AHO_CORASICK_ENGINE, DFA_ENGINE, build_automata, determinize
+
+TRIALS = 2000
+WORD_CHARS = 'abñsİ.'
+# case variants of the word chars, other multi-byte chars, chars whose upper case is a word char and line ends
+TEXT_CHARS = 'abABñÑsSſıi<>.,x \n€😀é\r'
+
+
+def find_in_chunks(automata, chunks):
+    found = []
+    offset = 0
+    for chunk in chunks:
+        found.extend((offset + position, sorted(word_ids)) for position, word_ids in automata.find_stream(chunk))
+        offset += len(chunk)
+    return found
+
+
+if __name__ == '__main__':
+    generator = random.Random(4)
+    for trial in range(TRIALS):
+        words = {''.join(generator.choice(WORD_CHARS) for _ in range(generator.randint(1, 3)))
+                 for _ in range(generator.randint(1, 4))}
+        engine = generator.choice([DFA_ENGINE, AHO_CORASICK_ENGINE])
+        nd_automata, word_counter = build_automata(words, engine)
+        d_automata = determinize(nd_automata, engine)
+        text = ''.join(generator.choice(TEXT_CHARS) for _ in range(generator.randint(0, 50))) + ENTER
+        # text files are read with universal newlines, and files read as bytes get the same line ends
+        read_text = text.replace('\r\n', ENTER).replace('\r', ENTER)
+        expected = find_in_chunks(compile_automata(d_automata), [read_text])
+        # cuts may split a multi-byte char or a CR LF pair, and a byte offset is reported on the last byte of its char
+        data = text.encode('utf-8')
+        cuts = sorted(generator.randint(0, len(data)) for _ in range(3))
+        chunks = translate_newlines(data[start:end] for start, end in zip([0] + cuts, cuts + [len(data)]))
+        read_data = read_text.encode('utf-8')
+        found = [(len(read_data[:position + 1].decode('utf-8')) - 1, word_ids)
+                 for position, word_ids in find_in_chunks(compile_byte_automata(d_automata), chunks)]
+        assert found == expected, (engine, words, text, cuts)
+    print("{} random texts found the same words with the text and the byte tables".format(TRIALS))
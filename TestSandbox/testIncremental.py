@@ -0,0 +1,61 @@
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from automata_util import *
+from tpe import EditableVocabulary
+
+TRIALS = 1000
+TEXT_CHARS = 'abcéABC <>.,x\n'
+
+
+def found_words(automata, vocabulary, text):
+    automata.reset()
+    found = automata.find_stream(text.encode('utf-8') if automata.binary else text)
+    return [sorted(vocabulary.word_counter.words[word_id] for word_id in word_ids) for _, word_ids in found]
+
+
+def rebuilt(vocabulary, binary):
+    nd = NDAutomata()
+    for word in vocabulary.words:
+        nd.add_word(word, vocabulary.word_ids[word])
+    d_automata = full_determinize(nd)
+    return d_automata, compile_byte_automata(d_automata) if binary else compile_automata(d_automata)
+
+
+if __name__ == '__main__':
+    generator = random.Random(5)
+    edits = 0
+    patched = 0
+    for trial in range(TRIALS):
+        pool = [''.join(generator.choice('abcé') for _ in range(generator.randint(1, 4))) for _ in range(8)]
+        pool += ['Ab', 'AB']
+        binary = trial % 2 == 1
+        vocabulary = EditableVocabulary(generator.sample(pool, generator.randint(1, 5)), binary)
+        for _ in range(generator.randint(1, 6)):
+            word = generator.choice(pool)
+            automata = vocabulary.automata
+            if word in vocabulary.words and generator.random() < 0.5:
+                assert vocabulary.remove_word(word)
+                assert not vocabulary.remove_word(word)
+            else:
+                present = word in vocabulary.words
+                assert vocabulary.add_word(word) != present
+            edits += 1
+            # a patched table keeps its automata, compiling it again builds a new one
+            patched += vocabulary.automata is automata
+        d_automata, table = rebuilt(vocabulary, binary)
+        text = ''.join(generator.choice(TEXT_CHARS) for _ in range(60)) + ENTER
+        expected = found_words(table, vocabulary, text)
+        assert found_words(vocabulary.automata, vocabulary, text) == expected, (vocabulary.words, text)
+        construction = vocabulary.subset_construction
+        reachable = set(get_automata_states(construction.automata))
+        assert len(reachable) == len(get_automata_states(d_automata)), (vocabulary.words, len(reachable))
+        # subsets no longer reached are forgotten before they are an eighth of the memoized ones
+        unreachable = sum(1 for dstate in construction.state_dict.values() if dstate not in reachable)
+        assert unreachable * 8 <= len(construction.state_dict), (vocabulary.words, unreachable)
+    assert patched * 2 > edits, (patched, edits)
+    print("{} edited vocabularies matched a full rebuild, {} of {} edits patched the table".format(TRIALS, patched,
+                                                                                                  edits))
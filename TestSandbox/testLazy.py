@@ -0,0 +1,27 @@
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from automata_util import *
+
+TRIALS = 2000
+WORD_CHARS = 'ab<>.x'
+TEXT_CHARS = 'abAB .,\n<>x'
+
+
+if __name__ == '__main__':
+    generator = random.Random(11)
+    for trial in range(TRIALS):
+        words = {''.join(generator.choice(WORD_CHARS) for _ in range(generator.randint(1, 3)))
+                 for _ in range(generator.randint(1, 5))}
+        nd = NDAutomata()
+        for word_id, word in enumerate(sorted(words)):
+            nd.add_word(word, word_id)
+        text = ''.join(generator.choice(TEXT_CHARS) for _ in range(generator.randint(0, 40))) + ENTER
+        expected = full_determinize(nd).find_stream(text)
+        # a few states make the lazy automata flush its states in the middle of the text
+        for max_states in (None, 3):
+            assert lazy_determinize(nd, max_states).find_stream(text) == expected, (words, text, max_states)
+    print("{} random texts found the same words with the dfa and the lazy-dfa engines".format(TRIALS))
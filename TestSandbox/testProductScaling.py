@@ -0,0 +1,56 @@
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from automata_util import *
+from tpe import build_vocabularies_automata, determinize_vocabularies
+
+VOCABULARIES = [1, 2, 4, 8]
+WORDS = 5000
+TEXT_WORDS = 20000
+MAX_GROWTH = 3.0
+MAX_STATES = 1000
+
+
+def random_words(size, seed):
+    generator = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        length = generator.randint(3, 12)
+        words.add(''.join(generator.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(length)))
+    return words
+
+
+def random_text(vocabularies, seed=0):
+    generator = random.Random(seed)
+    words = sorted(word for vocabulary in vocabularies.values() for word in vocabulary)
+    return ' '.join(generator.choice(words) for _ in range(TEXT_WORDS)) + ENTER
+
+
+def build_time(vocabularies, text, max_states=None):
+    start = time.perf_counter()
+    nd_automatas, _ = build_vocabularies_automata(vocabularies)
+    tables = [compile_automata(d_automata) for d_automata in determinize_vocabularies(nd_automatas)]
+    automata = LazyProductAutomata(tables, max_states)
+    found = automata.find_stream(text)
+    return time.perf_counter() - start, automata, found
+
+
+if __name__ == '__main__':
+    previous = None
+    for count in VOCABULARIES:
+        vocabularies = dict(('v{}'.format(seed), random_words(WORDS, seed)) for seed in range(count))
+        text = random_text(vocabularies)
+        elapsed, automata, found = build_time(vocabularies, text)
+        print("{} vocabularies: {:.2f}s, {} product states".format(count, elapsed, len(automata.state_dict)))
+        if previous is not None:
+            growth = elapsed / previous
+            assert growth < MAX_GROWTH, "build time grew {:.2f} times when doubling the vocabularies".format(growth)
+        previous = elapsed
+        # a scan only builds the product states it reaches, and no more than max_states of them at once
+        assert len(automata.state_dict) <= len(text)
+        _, bounded, bounded_found = build_time(vocabularies, text, MAX_STATES)
+        assert len(bounded.state_dict) <= MAX_STATES and bounded_found == found
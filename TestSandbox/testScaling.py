@@ -0,0 +1,41 @@
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from automata_util import *
+
+SIZES = [12500, 25000, 50000, 100000]
+MAX_GROWTH = 3.0
+
+
+def random_words(size, seed=0):
+    generator = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        length = generator.randint(3, 12)
+        words.add(''.join(generator.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(length)))
+    return words
+
+
+def build_time(words):
+    start = time.perf_counter()
+    nd = NDAutomata()
+    with gc_paused():
+        for word_id, word in enumerate(words):
+            nd.add_word(word, word_id)
+    full_determinize(nd)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    previous = None
+    for size in SIZES:
+        elapsed = build_time(random_words(size))
+        print("{} words: {:.2f}s".format(size, elapsed))
+        if previous is not None:
+            growth = elapsed / previous
+            assert growth < MAX_GROWTH, "build time grew {:.2f} times when doubling the words".format(growth)
+        previous = elapsed
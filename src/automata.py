@@ -7,26 +7,42 @@ DOT = '.'
 ENTER = '\n'
 OPEN_TAG = '<'
 CLOSE_TAG = '>'
+SEPARATORS = (SPACE, ENTER, COMMA, DOT)
+OTHER_CLASS = 0
 
 
 class AbstractAutomata:
     """
     Abstract class representing the concept of a finite automata, capable of consuming single characters or a stream
-    of them.
+    of them. Automata whose binary attribute is set consume streams of UTF-8 encoded bytes instead of text.
     """
     __metaclass__ = ABCMeta
+    binary = False
 
     def __init__(self, init_state):
         self.init_state = init_state
 
     def consume_stream(self, char_stream):
         """
-        Given a stream of characters, consume each of them and mutate the state of the automata
+        Given a stream of characters, consume each of them and mutate the state of the automata, calling reached_call
+        for every end state reached
         :param char_stream: stream to be consumed
         :return:
         """
-        for char in char_stream:
-            self.consume(char)
+        reached_call = self.reached_call
+        for _, word_ids in self.find_stream(char_stream):
+            reached_call(word_ids)
+
+    @abstractmethod
+    def find_stream(self, char_stream):
+        """
+        Given a stream of characters, consume each of them like consume_stream does, but return where end states were
+        reached instead of calling reached_call
+        :param char_stream: stream to be consumed
+        :return: list of offset - word ids tuples, the offset being the index in the stream of the char reaching the end
+        state, which is the one right after the found words
+        """
+        pass
 
     @abstractmethod
     def consume(self, char):
@@ -41,20 +57,26 @@ class AbstractAutomata:
     def current_state(self):
         pass
 
+    def reached_call(self, word_ids):
+        """
+        Called with the word ids of every end state reached. Does nothing unless replaced, usually by a word counter
+        :param word_ids: tuple of ids of the found words
+        :return:
+        """
+        pass
+
     def __str__(self):
         result_list = []
-        visited = set()
-
-        def traverse(state_aux, counter):
-            string = '{} => {}'.format(id(state_aux), state_aux)
-            result_list.append(string)
-            visited.add(state_aux)
+        visited = {self.init_state}
+        pending = [self.init_state]
+        while pending:
+            state_aux = pending.pop()
+            result_list.append('{} => {}'.format(id(state_aux), state_aux))
             for states in state_aux.transitions.values():
                 for state in states:
                     if state not in visited:
-                        traverse(state, counter + 1)
-
-        traverse(self.init_state, 0)
+                        visited.add(state)
+                        pending.append(state)
         return '\n'.join(result_list)
 
     def __repr__(self):
@@ -77,7 +99,18 @@ class Automata(AbstractAutomata):
     def consume(self, char):
         char = char.upper()
         self.__current_state = self.current_state.get(char)
-        self.__current_state.reached_call()
+        if self.__current_state.is_end_state:
+            self.reached_call(self.__current_state.word_ids)
+
+    def find_stream(self, char_stream):
+        found = []
+        state = self.__current_state
+        for position, char in enumerate(char_stream):
+            state = state.get(char.upper())
+            if state.is_end_state:
+                found.append((position, state.word_ids))
+        self.__current_state = state
+        return found
 
     @property
     def current_state(self):
@@ -85,17 +118,15 @@ class Automata(AbstractAutomata):
 
     def __str__(self):
         result_list = []
-        visited = set()
-
-        def traverse(state_aux, counter):
-            string = '{} => {}'.format(id(state_aux), state_aux)
-            result_list.append(string)
-            visited.add(state_aux)
+        visited = {self.init_state}
+        pending = [self.init_state]
+        while pending:
+            state_aux = pending.pop()
+            result_list.append('{} => {}'.format(id(state_aux), state_aux))
             for state in state_aux.transitions.values():
                 if state not in visited:
-                    traverse(state, counter + 1)
-
-        traverse(self.init_state, 0)
+                    visited.add(state)
+                    pending.append(state)
         return '\n'.join(result_list)
 
     def reset(self):
@@ -112,16 +143,9 @@ class NDAutomata(AbstractAutomata):
             init_state = NDState()
         AbstractAutomata.__init__(self, init_state)
         self.current_states = {init_state}
-        self.tag_state = NDState(transitions=dict([
-            (CLOSE_TAG, {self.init_state})
-        ]))
-        self.error_state = NDState(transitions=dict([
-            (SPACE, {self.init_state}),
-            (ENTER, {self.init_state}),
-            (COMMA, {self.init_state}),
-            (DOT, {init_state}),
-            (OPEN_TAG, {self.tag_state})
-        ]))
+        self.init_targets = (self.init_state,)
+        self.tag_state, self.error_state = tag_and_error_states(NDState, self.init_targets)
+        self.tag_targets = self.error_state.transitions[OPEN_TAG]
         self.init_state.transitions = dict([(OPEN_TAG, {self.tag_state})])
 
     @property
@@ -129,70 +153,147 @@ class NDAutomata(AbstractAutomata):
         return self.current_states
 
     def consume(self, char):
-        char = char.upper()
-        new_states = set()
-        for state in self.current_states:
-            for st in state.get(char):
-                if not (state.is_end_state and st == state):
-                    new_states.add(st)
-            for st in state.get(LAMBDA):
-                for s in st.get(char):
-                    new_states.add(s)
-        for state in new_states:
-            if state.is_end_state:
-                state.reached_call()
-        self.current_states = new_states
+        self.consume_stream(char)
+
+    def find_stream(self, char_stream):
+        found = []
+        current_states = self.current_states
+        for position, char in enumerate(char_stream):
+            char = char.upper()
+            new_states = set()
+            for state in current_states:
+                for st in state.get(char):
+                    if not (state.is_end_state and st == state):
+                        new_states.add(st)
+                for st in state.get(LAMBDA):
+                    for s in st.get(char):
+                        new_states.add(s)
+            for state in new_states:
+                if state.is_end_state:
+                    found.append((position, state.word_ids))
+            current_states = new_states
+        self.current_states = current_states
+        return found
+
+    def add_word(self, word, word_id):
+        uword = word.upper()
+        self.init_state.add_state(uword[0], self.__add_word(uword, word_id))
 
-    def add_word(self, word, reached_call):
+    def remove_word(self, word, word_id):
+        """
+        Removes a word added with add_word, unlinking its path from the init state
+        :param word: word to remove
+        :param word_id: id the word was added with
+        :return: whether the word was found and removed
+        """
         uword = word.upper()
-        self.init_state.add_state(uword[0], self.__add_word(uword, reached_call, 1))
-
-    def __add_word(self, word, reached_call, char_index):
-        if char_index == len(word):
-            final_state = NDState.end_state(self.init_state, reached_call, dict([(LAMBDA, {self.init_state})]))
-            final_state_with_tag = NDState.end_state(self.tag_state, reached_call, dict([(LAMBDA, {self.tag_state})]))
-            return NDState(self.error_state, False, dict([
-                (SPACE, {final_state}),
-                (ENTER, {final_state}),
-                (COMMA, {final_state}),
-                (DOT, {final_state}),
-                (OPEN_TAG, {final_state_with_tag})
-            ]))
-        return NDState(self.error_state, False,
-                       dict([
-                           (word[char_index], {self.__add_word(word, reached_call, char_index + 1)}),
-                           (OPEN_TAG, {self.tag_state})
-                       ]))
+        heads = self.init_state.transitions.get(uword[0], ())
+        for head in heads:
+            if self.__path_word_ids(head, uword[1:]) == (word_id,):
+                heads.remove(head)
+                if not heads:
+                    del self.init_state.transitions[uword[0]]
+                return True
+        return False
+
+    @staticmethod
+    def __path_word_ids(state, chars):
+        """
+        Follows the path of a word from its first state, returning the word ids of its end state
+        :param state: first state of the path
+        :param chars: rest of the chars of the word
+        :return: tuple of word ids, None if the path does not spell the chars
+        """
+        for char in chars:
+            targets = state.transitions.get(char, ())
+            if len(targets) != 1:
+                return None
+            state = next(iter(targets))
+        final_targets = state.transitions.get(ENTER)
+        if final_targets is None:
+            return None
+        return next(iter(final_targets)).word_ids
+
+    def __add_word(self, word, word_id):
+        # targets that never change are tuples, and the ones every word has are shared by all of them
+        final_state = NDState.end_state(self.init_state, (word_id,), dict([(LAMBDA, self.init_targets)]))
+        final_state_with_tag = NDState.end_state(self.tag_state, (word_id,), dict([(LAMBDA, self.tag_targets)]))
+        final_targets = (final_state,)
+        state = NDState(self.error_state, False, dict([
+            (SPACE, final_targets),
+            (ENTER, final_targets),
+            (COMMA, final_targets),
+            (DOT, final_targets),
+            (OPEN_TAG, (final_state_with_tag,))
+        ]))
+        for char in reversed(word[1:]):
+            state = NDState(self.error_state, False,
+                            dict([
+                                (char, (state,)),
+                                (OPEN_TAG, self.tag_targets)
+                            ]))
+        return state
 
     def reset(self):
         self.current_states = {self.init_state}
 
 
+class AhoCorasickTrie:
+    """
+    Keyword trie used to build an Aho-Corasick automata. Each word is added once as a path of DStates from init_state,
+    so building the trie is linear in the total length of the vocabulary.
+    """
+
+    def __init__(self):
+        self.init_state = DState()
+        self.word_ids = dict()
+
+    def add_word(self, word, word_id):
+        """
+        Add a word to the trie
+        :param word: word to be found
+        :param word_id: id reported every time the word is found
+        :return:
+        """
+        if not word:
+            return
+        state = self.init_state
+        for char in word.upper():
+            next_state = state.transitions.get(char)
+            if next_state is None:
+                next_state = DState()
+                state.transitions[char] = next_state
+            state = next_state
+        self.word_ids.setdefault(state, []).append(word_id)
+
+
 class AbstractState:
     """
-    Helper class representing a single automata state, with transitions and a callback function for end states.
+    Helper class representing a single automata state, with transitions and the ids of the words found by end states.
+    States are slotted, since automata hold lots of them.
     """
     __metaclass__ = ABCMeta
+    __slots__ = ('transitions', 'default_state', 'word_ids', 'is_end_state')
 
     def __init__(self, default_state=None, is_end_state=False, transitions=None):
         if transitions is None:
             transitions = dict()
         self.transitions = transitions
         self.default_state = default_state
-        self.reached_call = lambda: None
+        self.word_ids = ()
         self.is_end_state = is_end_state
 
     @classmethod
-    def end_state(cls, default_state, reached_call, transitions=None):
+    def end_state(cls, default_state, word_ids, transitions=None):
         """
-        Create an end state containing a function to be called when reaching it.
+        Create an end state containing the ids of the words found when reaching it.
         :param transitions: state transitions dict
         :param default_state: state to fall back to when given an invalid char
-        :param reached_call: function to be called when reaching the state
+        :param word_ids: tuple of ids of the words found when reaching the state
         :return:
         """
         result = cls(default_state, True, transitions)
-        result.reached_call = reached_call
+        result.word_ids = word_ids
         return result
 
     @abstractmethod
@@ -212,6 +313,7 @@ class DState(AbstractState):
     """
     Represents a Determined State with only one state to transition to per consumed character.
     """
+    __slots__ = ()
 
     def __str__(self):
         result = []
@@ -227,6 +329,12 @@ class DState(AbstractState):
 
 
 class NDState(AbstractState):
+    """
+    Represents a Non Determined State with a collection of states to transition to per consumed character. Targets
+    that are added to later are sets, fixed ones may be tuples.
+    """
+    __slots__ = ()
+
     def add_state(self, char_key, target):
         """
         Add a transition to a different state
@@ -251,9 +359,284 @@ class NDState(AbstractState):
 
     def get(self, char):
         if char == LAMBDA:
-            return self.transitions.get(LAMBDA, [])
+            return self.transitions.get(LAMBDA, ())
         if self.default_state is None:
-            return self.transitions.get(char, {self})
-        return self.transitions.get(char, {self.default_state})
+            return self.transitions.get(char, (self,))
+        return self.transitions.get(char, (self.default_state,))
+
+
+def tag_and_error_states(state_class, init_target):
+    """
+    Builds the tag state, skipping everything up to CLOSE_TAG, and the error state, skipping the rest of a word that can
+    not be found up to a separator or a tag, which every automata finding words shares
+    :param state_class: DState or NDState
+    :param init_target: target leading back to the init state, the init state for a DState or a tuple holding it for an
+    NDState
+    :return: tag state - error state tuple
+    """
+    tag_state = state_class(transitions=dict([(CLOSE_TAG, init_target)]))
+    tag_target = (tag_state,) if state_class is NDState else tag_state
+    error_state = state_class(transitions=dict([(separator, init_target) for separator in SEPARATORS] +
+                                               [(OPEN_TAG, tag_target)]))
+    return tag_state, error_state
+
+
+class ClassifyingAutomata(AbstractAutomata):
+    """
+    Abstract class of the automata mapping chars to character classes. key_classes holds the class of every upper case
+    transition key, and char_classes caches the class of every char seen, so each char is upper cased only once.
+    """
+
+    def char_class(self, char):
+        """
+        Given a char return its character class, caching the result for the next time it is seen
+        :param char: char to classify
+        :return: character class, OTHER_CLASS if the char is not a transition key
+        """
+        char_class = self.key_classes.get(char.upper(), OTHER_CLASS)
+        self.char_classes[char] = char_class
+        return char_class
+
+
+class TableAutomata(ClassifyingAutomata):
+    """
+    Represents a Deterministic Automata compiled into a flat integer transition table.
+    States are row offsets into the table and characters are mapped to character classes, so consuming a character is
+    a dict lookup plus an array index. Accepting states are numbered first, which makes checking for an accept action a
+    single comparison against accept_limit, and accepts holds the word ids of each accepting state.
+    Sink states, like the tag and error states, loop on every char but a few and are numbered last, from sink_limit on.
+    sink_exits holds a compiled pattern with the exit chars of each one, so a scan searches its chunk for the next
+    exit char instead of stepping through the chars in between.
+    A table compiled over UTF-8 bytes has byte_classes, mapping every byte to its class, and consumes raw bytes instead
+    of text, classifying a whole chunk at once with bytes.translate.
+    The table only holds arrays, dicts, tuples and patterns, so it can be pickled.
+    """
+
+    def __init__(self, init_state, table, class_count, key_classes, accept_limit, accepts, sink_limit=None,
+                 sink_exits=(), byte_classes=None):
+        AbstractAutomata.__init__(self, init_state)
+        self.table = table
+        self.class_count = class_count
+        self.key_classes = key_classes
+        self.char_classes = dict()
+        self.accept_limit = accept_limit
+        self.accepts = accepts
+        self.sink_limit = len(table) if sink_limit is None else sink_limit
+        self.sink_exits = sink_exits
+        self.byte_classes = byte_classes
+        self.__current_state = init_state
+
+    @property
+    def binary(self):
+        return self.byte_classes is not None
+
+    def consume(self, char):
+        if self.byte_classes is not None:
+            self.consume_stream(char.encode('utf-8'))
+            return
+        char_class = self.char_classes.get(char)
+        if char_class is None:
+            char_class = self.char_class(char)
+        self.__current_state = self.table[self.__current_state + char_class]
+        if self.__current_state < self.accept_limit:
+            self.reached_call(self.accepts[self.__current_state // self.class_count])
+
+    def find_stream(self, char_stream):
+        if self.byte_classes is not None:
+            if not isinstance(char_stream, bytes):
+                char_stream = bytes(char_stream)
+            return self.__find_bytes(char_stream)
+        if not isinstance(char_stream, str):
+            char_stream = ''.join(char_stream)
+        return self.__find_chars(char_stream)
+
+    def __find_chars(self, text):
+        """
+        Given text, consume each of its chars and mutate the state of the automata. The text is looped over by index,
+        so a sink state jumps to the next exit char with a search from the current index.
+        :param text: text to be consumed
+        :return: list of offset - word ids tuples
+        """
+        table = self.table
+        char_classes = self.char_classes
+        accept_limit = self.accept_limit
+        accepts = self.accepts
+        class_count = self.class_count
+        sink_limit = self.sink_limit
+        sink_exits = self.sink_exits
+        found = []
+        state = self.__current_state
+        position = 0
+        length = len(text)
+        while position < length:
+            if state >= sink_limit:
+                match = sink_exits[(state - sink_limit) // class_count].search(text, position)
+                if match is None:
+                    break
+                position = match.start()
+            for position in range(position, length):
+                char = text[position]
+                char_class = char_classes.get(char)
+                if char_class is None:
+                    char_class = self.char_class(char)
+                state = table[state + char_class]
+                if state < accept_limit:
+                    found.append((position, accepts[state // class_count]))
+                elif state >= sink_limit:
+                    position += 1
+                    break
+            else:
+                break
+        self.__current_state = state
+        return found
+
+    def __find_bytes(self, byte_stream):
+        """
+        Given UTF-8 encoded bytes, consume each of them and mutate the state of the automata. The classes of the bytes
+        are looped over from an index through a memoryview, which slices without copying, so a sink state jumps to the
+        next exit byte with a search from the current index.
+        :param byte_stream: bytes to be consumed
+        :return: list of offset - word ids tuples
+        """
+        table = self.table
+        accept_limit = self.accept_limit
+        accepts = self.accepts
+        class_count = self.class_count
+        sink_limit = self.sink_limit
+        sink_exits = self.sink_exits
+        byte_classes = memoryview(byte_stream.translate(self.byte_classes))
+        found = []
+        state = self.__current_state
+        position = 0
+        length = len(byte_stream)
+        while position < length:
+            if state >= sink_limit:
+                match = sink_exits[(state - sink_limit) // class_count].search(byte_stream, position)
+                if match is None:
+                    break
+                position = match.start()
+            for position, byte_class in enumerate(byte_classes[position:], position):
+                state = table[state + byte_class]
+                if state < accept_limit:
+                    found.append((position, accepts[state // class_count]))
+                elif state >= sink_limit:
+                    position += 1
+                    break
+            else:
+                break
+        self.__current_state = state
+        return found
+
+    @property
+    def current_state(self):
+        return self.__current_state
+
+    def __str__(self):
+        result_list = []
+        for state in range(0, len(self.table), self.class_count):
+            row = self.table[state:state + self.class_count]
+            result_list.append('{} => {}'.format(state, list(row)))
+        return '\n'.join(result_list)
+
+    def reset(self):
+        self.__current_state = self.init_state
+
+
+class BitParallelAutomata(ClassifyingAutomata):
+    """
+    Simulates an NDAutomata in the Shift-And style, without determinizing it. The states of every word path are
+    consecutive bits of a Python int, so advancing all of them on a char is a shift and an and with the mask of that
+    char class. The init, tag and error states are flags, and the end states reached after a separator or a tag are
+    int masks sharing the bit of the word's last path state.
+    """
+
+    def __init__(self, key_classes, class_count, heads, advances, sep_classes, open_class, close_class,
+                 complete_mask, bit_words):
+        AbstractAutomata.__init__(self, None)
+        self.key_classes = key_classes
+        self.char_classes = dict()
+        self.class_count = class_count
+        self.heads = heads
+        self.advances = advances
+        self.sep_classes = sep_classes
+        self.open_class = open_class
+        self.close_class = close_class
+        self.complete_mask = complete_mask
+        self.bit_words = bit_words
+        self.reset()
 
+    def consume(self, char):
+        self.consume_stream(char)
+
+    def find_stream(self, char_stream):
+        char_classes = self.char_classes
+        heads = self.heads
+        advances = self.advances
+        sep_classes = self.sep_classes
+        open_class = self.open_class
+        close_class = self.close_class
+        complete_mask = self.complete_mask
+        chain_mask = ~complete_mask
+        bit_words = self.bit_words
+        found_words = []
+        states, init, tag, error, found, found_tag = self.__current_state
+        for position, char in enumerate(char_stream):
+            char_class = char_classes.get(char)
+            if char_class is None:
+                char_class = self.char_class(char)
+            chain = states & chain_mask
+            complete = states & complete_mask
+            new_init = found != 0
+            new_tag = found_tag != 0
+            new_error = False
+            new_found = 0
+            new_found_tag = 0
+            states = (chain << 1) & advances[char_class]
+            if init or found:
+                states |= heads[char_class]
+                if char_class == open_class:
+                    new_tag = True
+                elif not heads[char_class]:
+                    new_init = True
+            if tag or found_tag:
+                if char_class == close_class:
+                    new_init = True
+                else:
+                    new_tag = True
+            if error:
+                if char_class in sep_classes:
+                    new_init = True
+                elif char_class == open_class:
+                    new_tag = True
+                else:
+                    new_error = True
+            if chain:
+                if char_class == open_class:
+                    new_tag = True
+                elif chain & ~(advances[char_class] >> 1):
+                    new_error = True
+            if complete:
+                if char_class in sep_classes:
+                    new_found = complete
+                elif char_class == open_class:
+                    new_found_tag = complete
+                else:
+                    new_error = True
+            for reached in (new_found, new_found_tag):
+                while reached:
+                    lowest = reached & -reached
+                    found_words.append((position, bit_words[lowest.bit_length() - 1]))
+                    reached ^= lowest
+            init, tag, error, found, found_tag = new_init, new_tag, new_error, new_found, new_found_tag
+        self.__current_state = (states, init, tag, error, found, found_tag)
+        return found_words
 
+    @property
+    def current_state(self):
+        return self.__current_state
+
+    def __str__(self):
+        return 'BitParallelAutomata({} bits, {} classes)'.format(len(self.bit_words), self.class_count)
+
+    def reset(self):
+        self.__current_state = (0, True, False, False, 0, 0)
@@ -1,8 +1,28 @@
 from automata import *
-import copy
+import gc
+import re
+import sys
+from array import array
+from collections import defaultdict, deque
+from contextlib import contextmanager
 from functools import reduce
 
 
+@contextmanager
+def gc_paused():
+    """
+    Context manager pausing the cyclic garbage collector. Building an automata allocates lots of long lived objects and
+    no garbage, so collecting meanwhile only adds time that grows with the size of the automata.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
 def get_automata_states(automata):
     """
     Given an automata, returns a list with all its states.
@@ -10,28 +30,87 @@ def get_automata_states(automata):
     :return: list with the automata states.
     """
     states = []
-    next_states = []
-    __get_automata_states(automata.init_state, states, next_states)
-    return states
-
-
-def __get_automata_states(current_state, states, next_states):
-    if current_state not in states:
+    visited = set()
+    next_states = [automata.init_state]
+    while next_states:
+        current_state = next_states.pop()
+        if current_state in visited:
+            continue
+        visited.add(current_state)
         states.append(current_state)
-        transitions = current_state.transitions.values()
-        for transition in transitions:
+        for transition in current_state.transitions.values():
             if isinstance(current_state, NDState):
-                for trans in transition:
-                    next_states.append(trans)
+                next_states.extend(transition)
             elif isinstance(current_state, DState):
                 next_states.append(transition)
         if current_state.default_state is not None:
             next_states.append(current_state.default_state)
-    if next_states:
-        __get_automata_states(next_states.pop(), states, next_states)
     return states
 
 
+def breadth_first_states(automata, max_depth=None):
+    """
+    Given an automata, returns a generator of its states in breadth first order from the init state, so big automata
+    can be walked without listing their states first
+    :param automata: automata to get the states from
+    :param max_depth: amount of transitions away from the init state of the last states returned, None for every state
+    :return: generator of states
+    """
+    visited = {automata.init_state}
+    level = [automata.init_state]
+    depth = 0
+    while level:
+        next_level = []
+        for state in level:
+            yield state
+            if depth == max_depth:
+                continue
+            for target in state_targets(state):
+                if target not in visited:
+                    visited.add(target)
+                    next_level.append(target)
+        level = next_level
+        depth += 1
+
+
+def word_path_states(automata, words):
+    """
+    Given an automata and some of its words, returns a generator of the states consuming them from the init state,
+    their end states included
+    :param automata: NDAutomata or Automata
+    :param words: words whose paths are returned
+    :return: generator of states
+    """
+    visited = set()
+    for word in words:
+        states = [automata.init_state]
+        for char in word.upper() + SPACE:
+            for state in states:
+                if state not in visited:
+                    visited.add(state)
+                    yield state
+            next_states = []
+            for state in states:
+                targets = state.transitions.get(char)
+                if targets is not None:
+                    next_states.extend(targets if isinstance(state, NDState) else (targets,))
+            states = next_states
+        for state in states:
+            if state not in visited:
+                visited.add(state)
+                yield state
+
+
+def state_targets(state):
+    for targets in state.transitions.values():
+        if isinstance(state, NDState):
+            yield from targets
+        else:
+            yield targets
+    if state.default_state is not None:
+        yield state.default_state
+
+
 def lambda_closure(state):
     """
     Given a state, returns its LAMBDA closure
@@ -40,145 +119,1160 @@ def lambda_closure(state):
     """
 
     closure = {state}
-
-    def lambda_closure_aux(state_aux):
-        lambda_transitions = state_aux.get(LAMBDA)
-        for transition in lambda_transitions:
+    pending = [state]
+    while pending:
+        for transition in pending.pop().get(LAMBDA):
             if transition not in closure:
                 closure.add(transition)
-                lambda_closure_aux(transition)
+                pending.append(transition)
+    return closure
+
 
-    lambda_closure_aux(state)
+def closure_states(state, closures):
+    """
+    Given a state, returns the states of its LAMBDA closure. Closures of states with LAMBDA transitions are memoized
+    :param state: state to get the closure of
+    :param closures: dictionary of state to closure, shared by every call for the same automata
+    :return: tuple of states
+    """
+    if LAMBDA not in state.transitions:
+        return (state,)
+    closure = closures.get(state)
+    if closure is None:
+        closure = tuple(lambda_closure(state))
+        closures[state] = closure
     return closure
 
 
-def eliminate_lambdas(automata):
+def merge_word_ids(states):
     """
-    Given a Non Deterministic Automata with LAMBDA transitions, returns an equivalent Non Deterministic Automata 
-    without LAMBDA transitions
-    :param automata: NDAutomata with LAMBDA transitions
-    :return: NDAutomata without LAMBDA transitions
+    Given a set of states, returns the sorted ids of the words found by its end states
+    :param states: set of states
+    :return: tuple of word ids
     """
+    return tuple(sorted(word_id for state in states if state.is_end_state for word_id in state.word_ids))
 
-    visited = set()
-    result_automata = copy.deepcopy(automata)
 
-    def eliminate_lambda_aux(state):
-        new_transitions = dict()
-        closure = lambda_closure(state)
-        for lambda_state in closure:
-            for transition, destination in lambda_state.transitions.items():
-                if transition != LAMBDA:
-                    destination_states = new_transitions.get(transition, [])
-                    destination_states.extend(destination)
-                    new_transitions[transition] = destination_states
-        state.transitions = new_transitions
-        visited.add(state)
-        for transition, states in state.transitions.items():
-            for transition_state in states:
-                if transition_state not in visited:
-                    eliminate_lambda_aux(transition_state)
+def merge_transitions(states, closures):
+    """
+    Given a set of states, returns a dictionary with the combined transitions of their LAMBDA closures, without the
+    LAMBDA transitions, and the set of chars whose targets were merged. The targets of the other chars are the
+    containers of a single state, which are shared instead of copied, so they must not be mutated.
+    :param states: set of states
+    :param closures: dictionary of memoized closures, as used by closure_states
+    :return: combined transition dictionary - merged chars set
+    """
 
-    eliminate_lambda_aux(result_automata.init_state)
-    return result_automata
+    result_transitions = dict()
+    merged = set()
+    contributors = set()
+    for state in states:
+        for closure_state in closure_states(state, closures):
+            if closure_state in contributors:
+                continue
+            contributors.add(closure_state)
+            for transition, targets in closure_state.transitions.items():
+                if transition == LAMBDA:
+                    continue
+                actual_transitions = result_transitions.get(transition)
+                if actual_transitions is None:
+                    result_transitions[transition] = targets
+                elif transition in merged:
+                    actual_transitions.update(targets)
+                else:
+                    result_transitions[transition] = set(actual_transitions).union(targets)
+                    merged.add(transition)
+    return result_transitions, merged
 
 
-def unify_functions(funcs):
+class SubsetConstruction:
     """
-    Given a list of functions returns a single function that calls all of them
-    :param funcs: function iterable
-    :return: single function calling all in list
+    Determinizes a Non Deterministic Automata through subset construction, keeping the DState built for every set of
+    NDStates. LAMBDA transitions are followed while merging the transitions of each set, so the NDAutomata is neither
+    copied nor modified.
+    Words added to or removed from the NDAutomata through add_word and remove_word only change the transitions of the
+    init state and of the states that fall back to it, so only those transitions and the sets of states they now lead
+    to are built, reusing the DStates of every set that did not change. Each update leaves the key whose transitions
+    changed in changed_key, the DStates whose transition for it changed in changed_states and the DStates it forgot in
+    evicted_states, so a compiled table can be patched. Once the updates built or left behind about an eighth of the
+    memoized sets, the sets whose DStates are no longer reached are forgotten.
     """
 
-    def call_all():
-        for func in funcs:
-            func()
+    def __init__(self, automata):
+        self.nd_automata = automata
+        self.state_dict = dict()
+        self.frozen_targets = dict()
+        self.closures = dict()
+        self.pending = []
+        self.init_subsets = None
+        self.changed_key = None
+        self.changed_states = []
+        self.evicted_states = []
+        self.churn = 0
 
-    return call_all
+        init_word_ids = merge_word_ids({automata.init_state})
+        if len(init_word_ids) > 0:
+            self.initial_dstate = DState.end_state(default_state=None, word_ids=init_word_ids)
+        else:
+            self.initial_dstate = DState()
+        self.tag_state, self.error_state = tag_and_error_states(DState, self.initial_dstate)
+        self.initial_dstate.transitions = dict([(OPEN_TAG, self.tag_state)])
+        nd_tag_state = next(iter(automata.init_state.transitions[OPEN_TAG]))
 
+        self.state_dict[frozenset({automata.init_state})] = self.initial_dstate
+        self.state_dict[frozenset({nd_tag_state})] = self.tag_state
 
-def merge_transitions(states):
-    """
-    Given a set of states, returns a dictionary with the combined transitions.
-    :param states: set of states
-    :return: combined transition dictionary
-    """
+        transitions, merged = merge_transitions({automata.init_state}, self.closures)
+        for trans, equivalent in transitions.items():
+            self.initial_dstate.transitions[trans] = self.powerset_state(self.freeze(equivalent, trans not in merged))
+        self.construct()
+        self.automata = Automata(self.initial_dstate)
 
-    result_transitions = dict()
-    for state in states:
-        for transition, states_set in state.transitions.items():
-            actual_transitions = result_transitions.get(transition, set())
-            actual_transitions.update(states_set)
-            result_transitions[transition] = actual_transitions
-    return result_transitions
+    def powerset_state(self, ndstate_equivalents):
+        if ndstate_equivalents in self.state_dict:
+            return self.state_dict[ndstate_equivalents]
+        word_ids = merge_word_ids(ndstate_equivalents)
+        if len(word_ids) > 0:
+            new_state = DState.end_state(self.initial_dstate, word_ids)
+        else:
+            has_default_state = reduce((lambda x, y: x or y.default_state is not None), ndstate_equivalents, False)
+            if has_default_state:
+                new_error_state = self.error_state
+            else:
+                new_error_state = None
+            new_state = DState(default_state=new_error_state)
+        self.state_dict[ndstate_equivalents] = new_state
+        self.pending.append((ndstate_equivalents, new_state))
+        if self.init_subsets is not None and self.falls_back_to_init(ndstate_equivalents):
+            self.init_subsets.append(ndstate_equivalents)
+        return new_state
+
+    def freeze(self, targets, shared):
+        # targets shared between states are frozen once, so their frozenset hash is only computed once too
+        if not shared:
+            return frozenset(targets)
+        frozen = self.frozen_targets.get(id(targets))
+        if frozen is None:
+            frozen = (targets, frozenset(targets))
+            self.frozen_targets[id(targets)] = frozen
+        return frozen[1]
+
+    def construct(self):
+        """
+        Builds the transitions of every pending DState, and of the DStates they lead to
+        """
+        while self.pending:
+            ndstate_equivalents, new_state = self.pending.pop()
+            transitions, merged = merge_transitions(ndstate_equivalents, self.closures)
+            for transition, nds_eq in transitions.items():
+                new_state.transitions[transition] = self.powerset_state(self.freeze(nds_eq, transition not in merged))
+
+    def falls_back_to_init(self, ndstate_equivalents):
+        init_state = self.nd_automata.init_state
+        return any(init_state in closure_states(state, self.closures) for state in ndstate_equivalents)
+
+    def add_word(self, word, word_id):
+        """
+        Adds a word to the NDAutomata and updates the Deterministic Automata to find it too
+        :param word: word to be found
+        :param word_id: id reported when finding the word
+        """
+        self.update(word, lambda: self.nd_automata.add_word(word, word_id))
+
+    def remove_word(self, word, word_id):
+        """
+        Removes a word from the NDAutomata and updates the Deterministic Automata to stop finding it
+        :param word: word added with add_word
+        :param word_id: id the word was added with
+        :return: whether the word was found and removed
+        """
+        removed = []
+        self.update(word, lambda: removed.append(self.nd_automata.remove_word(word, word_id)))
+        return removed[0]
+
+    def update(self, word, change):
+        """
+        Applies a change to the init state transitions of the NDAutomata for the first char of a word, then rebuilds
+        that transition in every DState whose set of states falls back to the init state
+        :param word: word whose first char transitions change
+        :param change: function changing the NDAutomata
+        """
+        if self.init_subsets is None:
+            self.init_subsets = [subset for subset in self.state_dict if self.falls_back_to_init(subset)]
+        key = word.upper()[0]
+        init_transitions = self.nd_automata.init_state.transitions
+        self.frozen_targets.pop(id(init_transitions.get(key)), None)
+        change()
+        state_count = len(self.state_dict)
+        changed_states = []
+        for subset in list(self.init_subsets):
+            contributors = dict()
+            for state in subset:
+                for closure_state in closure_states(state, self.closures):
+                    targets = closure_state.transitions.get(key)
+                    if targets is not None:
+                        contributors[id(targets)] = targets
+            dstate = self.state_dict[subset]
+            previous = dstate.transitions.get(key)
+            if not contributors:
+                dstate.transitions.pop(key, None)
+            elif len(contributors) == 1:
+                dstate.transitions[key] = self.powerset_state(self.freeze(next(iter(contributors.values())), True))
+            else:
+                dstate.transitions[key] = self.powerset_state(frozenset().union(*contributors.values()))
+            if dstate.transitions.get(key) is not previous:
+                changed_states.append(dstate)
+        self.construct()
+        self.changed_key = key
+        self.changed_states = changed_states
+        # an edit leaves behind at most the states along the word path, its end states after a separator and after a
+        # tag, and as many states as it builds
+        self.churn += len(word) + 2 + len(self.state_dict) - state_count
+        if self.churn * 8 > len(self.state_dict):
+            self.evicted_states = self.prune()
+        else:
+            self.evicted_states = []
+
+    def prune(self):
+        """
+        Forgets the sets of states whose DStates the automata no longer reaches, so updates stop rebuilding them. The
+        memoized closures and frozen targets are dropped too, since they may hold states of removed words
+        :return: list of forgotten DStates
+        """
+        reachable = set(get_automata_states(self.automata))
+        evicted = [dstate for dstate in self.state_dict.values() if dstate not in reachable]
+        self.state_dict = dict((subset, dstate) for subset, dstate in self.state_dict.items() if dstate in reachable)
+        self.init_subsets = [subset for subset in self.init_subsets if subset in self.state_dict]
+        self.frozen_targets = dict()
+        self.closures = dict()
+        self.churn = 0
+        return evicted
 
 
 def determinize_automata(automata):
     """
-    Given a Non Deterministic Automata, without LAMBDA transitions, returns an equivalent Deterministic Automata
+    Given a Non Deterministic Automata, returns an equivalent Deterministic Automata, as built by SubsetConstruction
     :param automata: non deterministic automata
     :return: equivalent deterministic automata
     """
+    return SubsetConstruction(automata).automata
+
+
+def full_determinize(automata):
+    """
+    Given a Non Deterministic Automata, returns an equivalent Deterministic Automata
+    :param automata: NDAutomata to determinize
+    :return: Deterministic Automata equivalent to the given automata
+    """
+    with gc_paused():
+        return determinize_automata(automata)
+
+
+class ProductState:
+    """
+    State of a LazyProductAutomata, standing for the rows of a state of every table it runs. transitions memoizes the
+    state each char leads to, word_ids holds the words found when reaching it and exits, when every table is in a sink
+    state, the pattern matching the chars that leave any of them.
+    """
+    __slots__ = ('rows', 'transitions', 'word_ids', 'exits')
+
+    def __init__(self, rows, word_ids, exits):
+        self.rows = rows
+        self.transitions = dict()
+        self.word_ids = word_ids
+        self.exits = exits
+
+
+class LazyProductAutomata(AbstractAutomata):
+    """
+    Runs several TableAutomata at once, so each of them finds exactly the words it finds on its own, whatever the others
+    find. The product of their states is built on demand, as LazyAutomata does, so only the tuples of states a scan
+    reaches are ever built, instead of a product growing with the amount of tables. While every table is in a sink
+    state, the scan searches the chunk for the next char leaving any of them.
+    When max_states is given, creating a state past that amount flushes every memoized state and the scan goes on
+    building them again, so memory stays bounded. Memoized states are not pickled.
+    """
+
+    def __init__(self, tables, max_states=None):
+        AbstractAutomata.__init__(self, None)
+        self.tables = tables
+        self.max_states = max_states
+        self.flushes = 0
+        self.state_dict = dict()
+        self.flush()
+        self.flushes = 0
+        self.__current_state = self.init_state
+
+    @property
+    def binary(self):
+        return self.tables[0].binary
 
-    state_dict = dict()
+    def flush(self):
+        """
+        Forgets every built state, building the init state again
+        :return:
+        """
+        self.state_dict = dict()
+        self.init_state = self.__state(tuple(table.init_state for table in self.tables))
+        self.flushes += 1
 
-    def powerset_construction(ndstate_equivalents):
-        if ndstate_equivalents not in state_dict:
-            reached_calls = list(get_reached_calls(ndstate_equivalents))
-            if len(reached_calls) > 0:
-                new_state = DState.end_state(initial_dstate, unify_functions(reached_calls))
+    def __state(self, rows):
+        state = self.state_dict.get(rows)
+        if state is not None:
+            return state
+        word_ids = set()
+        exits = []
+        for table, row in zip(self.tables, rows):
+            if row < table.accept_limit:
+                word_ids.update(table.accepts[row // table.class_count])
+            elif row >= table.sink_limit:
+                exits.append(table.sink_exits[(row - table.sink_limit) // table.class_count])
+        if len(exits) < len(rows):
+            exits = None
+        elif len(exits) == 1:
+            exits = exits[0]
+        else:
+            exits = re.compile(b'|'.join(pattern.pattern for pattern in exits) if self.binary
+                               else '|'.join(pattern.pattern for pattern in exits))
+        state = ProductState(rows, tuple(sorted(word_ids)), exits)
+        self.state_dict[rows] = state
+        return state
+
+    def expand(self, state, char):
+        """
+        Computes and memoizes the transition of a state for a char, a byte for binary tables
+        :param state: state consuming the char
+        :param char: consumed char
+        :return: state to transition to
+        """
+        rows = []
+        for table, row in zip(self.tables, state.rows):
+            if table.byte_classes is not None:
+                char_class = table.byte_classes[char]
             else:
-                has_default_state = reduce((lambda x, y: x or y.default_state is not None), ndstate_equivalents, False)
-                if has_default_state:
-                    new_error_state = error_state
-                else:
-                    new_error_state = None
-                new_state = DState(default_state=new_error_state)
+                char_class = table.char_classes.get(char)
+                if char_class is None:
+                    char_class = table.char_class(char)
+            rows.append(table.table[row + char_class])
+        if self.max_states is not None and len(self.state_dict) >= self.max_states:
+            self.flush()
+        next_state = self.__state(tuple(rows))
+        state.transitions[char] = next_state
+        return next_state
+
+    def consume(self, char):
+        self.consume_stream(char.encode('utf-8') if self.binary else char)
+
+    def find_stream(self, char_stream):
+        if not isinstance(char_stream, (str, bytes)):
+            char_stream = bytes(char_stream) if self.binary else ''.join(char_stream)
+        found = []
+        state = self.__current_state
+        position = 0
+        length = len(char_stream)
+        while position < length:
+            if state.exits is not None:
+                match = state.exits.search(char_stream, position)
+                if match is None:
+                    break
+                position = match.start()
+            for position in range(position, length):
+                char = char_stream[position]
+                next_state = state.transitions.get(char)
+                if next_state is None:
+                    next_state = self.expand(state, char)
+                state = next_state
+                if state.word_ids:
+                    found.append((position, state.word_ids))
+                elif state.exits is not None:
+                    position += 1
+                    break
+            else:
+                break
+        self.__current_state = state
+        return found
+
+    @property
+    def current_state(self):
+        return self.__current_state
+
+    def reset(self):
+        self.__current_state = self.init_state
+
+    def __getstate__(self):
+        return dict(tables=self.tables, max_states=self.max_states)
+
+    def __setstate__(self, state):
+        self.__init__(state['tables'], state['max_states'])
+
+
+class LazyState(DState):
+    """
+    DState built by a LazyAutomata, holding the subset of NDStates it stands for.
+    """
+    __slots__ = ('subset',)
 
-            state_dict[ndstate_equivalents] = new_state
 
-            for transition, nds_eq in merge_transitions(ndstate_equivalents).items():
-                new_state.transitions[transition] = powerset_construction(frozenset(nds_eq))
+class LazyAutomata(AbstractAutomata):
+    """
+    Deterministic Automata built on demand from a Non Deterministic Automata. A LazyState is only created, and each of
+    its transitions only computed, the first time a scan needs it. LazyStates are memoized by the frozenset of NDStates
+    they stand for, as determinize_automata does, and behave exactly like its states.
+    When max_states is given, creating a state past that amount flushes every memoized state and the scan goes on
+    building them again, so memory stays bounded.
+    """
 
-            return new_state
+    def __init__(self, automata, max_states=None):
+        init_word_ids = merge_word_ids({automata.init_state})
+        if len(init_word_ids) > 0:
+            init_state = LazyState.end_state(default_state=None, word_ids=init_word_ids)
         else:
-            return state_dict[ndstate_equivalents]
+            init_state = LazyState()
+        init_state.subset = frozenset({automata.init_state})
+        AbstractAutomata.__init__(self, init_state)
+        self.tag_state, self.error_state = tag_and_error_states(DState, init_state)
+        self.nd_tag_state = next(iter(automata.init_state.transitions[OPEN_TAG]))
+        self.max_states = max_states
+        self.closures = dict()
+        self.flushes = 0
+        self.state_dict = dict()
+        self.flush()
+        self.flushes = 0
+        self.__current_state = init_state
 
-    def get_reached_calls(equivalents):
-        return [state.reached_call for state in equivalents if state.is_end_state]
+    def flush(self):
+        """
+        Forgets every built state but the init, tag and error states. The init state transitions are built again from
+        its set of NDStates too, OPEN_TAG included, since words may start with it
+        :return:
+        """
+        self.state_dict = dict([
+            (self.init_state.subset, self.init_state),
+            (frozenset({self.nd_tag_state}), self.tag_state)
+        ])
+        self.init_state.transitions = dict()
+        self.flushes += 1
 
-    init_reached_calls = list(get_reached_calls({automata.init_state}))
+    def __state(self, subset):
+        state = self.state_dict.get(subset)
+        if state is not None:
+            return state
+        if self.max_states is not None and len(self.state_dict) >= self.max_states:
+            self.flush()
+            state = self.state_dict.get(subset)
+            if state is not None:
+                return state
+        word_ids = merge_word_ids(subset)
+        if len(word_ids) > 0:
+            state = LazyState.end_state(self.init_state, word_ids)
+        elif any(nd_state.default_state is not None for nd_state in subset):
+            state = LazyState(default_state=self.error_state)
+        else:
+            state = LazyState()
+        state.subset = subset
+        self.state_dict[subset] = state
+        return state
 
-    if len(init_reached_calls) > 0:
-        initial_dstate = DState.end_state(default_state=None, reached_call=unify_functions(init_reached_calls))
-    else:
-        initial_dstate = DState()
-    tag_state = DState(transitions=dict([
-        (CLOSE_TAG, initial_dstate)
-    ]))
-    error_state = DState(transitions=dict([
-        (SPACE, initial_dstate),
-        (ENTER, initial_dstate),
-        (COMMA, initial_dstate),
-        (DOT, initial_dstate),
-        (OPEN_TAG, tag_state)
-    ]))
-    initial_dstate.transitions = dict([(OPEN_TAG, tag_state)])
-    nd_tag_state = next(iter(automata.init_state.transitions[OPEN_TAG]))
+    def expand(self, state, char):
+        """
+        Computes and memoizes the transition of a state for a char
+        :param state: state consuming the char
+        :param char: consumed char
+        :return: state to transition to
+        """
+        key = char.upper()
+        subset = getattr(state, 'subset', None)
+        if subset is None:
+            next_state = state.get(key)
+        else:
+            found = False
+            targets = set()
+            for nd_state in subset:
+                for closure_state in closure_states(nd_state, self.closures):
+                    nd_targets = closure_state.transitions.get(key)
+                    if nd_targets is not None:
+                        found = True
+                        targets.update(nd_targets)
+            if found:
+                next_state = self.__state(frozenset(targets))
+            elif state.default_state is not None:
+                next_state = state.default_state
+            else:
+                next_state = state
+        state.transitions[char] = next_state
+        return next_state
 
-    state_dict[frozenset({automata.init_state})] = initial_dstate
-    state_dict[frozenset({nd_tag_state})] = tag_state
+    def consume(self, char):
+        next_state = self.__current_state.transitions.get(char)
+        if next_state is None:
+            next_state = self.expand(self.__current_state, char)
+        self.__current_state = next_state
+        if next_state.is_end_state:
+            self.reached_call(next_state.word_ids)
 
-    for trans, equivalent in merge_transitions({automata.init_state}).items():
-        initial_dstate.transitions[trans] = powerset_construction(frozenset(equivalent))
+    def find_stream(self, char_stream):
+        found = []
+        state = self.__current_state
+        for position, char in enumerate(char_stream):
+            next_state = state.transitions.get(char)
+            if next_state is None:
+                next_state = self.expand(state, char)
+            state = next_state
+            if state.is_end_state:
+                found.append((position, state.word_ids))
+        self.__current_state = state
+        return found
 
-    return Automata(initial_dstate)
+    @property
+    def current_state(self):
+        return self.__current_state
 
+    def reset(self):
+        self.__current_state = self.init_state
 
-def full_determinize(automata):
+
+def lazy_determinize(automata, max_states=None):
     """
-    Given a Non Deterministic Automata, returns an equivalent Deterministic Automata
+    Given a Non Deterministic Automata, returns an equivalent LazyAutomata
     :param automata: NDAutomata to determinize
-    :return: Deterministic Automata equivalent to the given automata
+    :param max_states: maximum amount of memoized states, None for no limit
+    :return: LazyAutomata equivalent to the given automata
+    """
+    with gc_paused():
+        return LazyAutomata(automata, max_states)
+
+
+def aho_corasick_automata(trie):
+    """
+    Given an AhoCorasickTrie, returns an equivalent Deterministic Automata, completing the trie states in place.
+    Failure links point to the longest proper suffix of a state that starts right after a separator, so words are only
+    found at word boundaries, and a word is reported when it is followed by a separator or a tag. Tag contents are
+    skipped and chars that can not start a word are skipped while waiting for one, just like the init state of an
+    NDAutomata.
+    :param trie: AhoCorasickTrie with the words to find
+    :return: Deterministic Automata finding the trie words
+    """
+
+    init_state = trie.init_state
+    tag_state, error_state = tag_and_error_states(DState, init_state)
+
+    fail = {init_state: None}
+    word_ids = {init_state: tuple(trie.word_ids.get(init_state, ()))}
+    goto = dict()
+    order = []
+    queue = deque([init_state])
+    while queue:
+        state = queue.popleft()
+        order.append(state)
+        goto[state] = dict(state.transitions)
+        for char, child in goto[state].items():
+            fail_state = fail[state]
+            while fail_state is not None and char not in goto[fail_state]:
+                fail_state = fail[fail_state]
+            if fail_state is not None:
+                fail[child] = goto[fail_state][char]
+            elif char in SEPARATORS:
+                fail[child] = init_state
+            else:
+                fail[child] = None
+            inherited = word_ids[fail[child]] if fail[child] is not None else ()
+            word_ids[child] = tuple(trie.word_ids.get(child, ())) + inherited
+            queue.append(child)
+
+    for state in order:
+        fail_state = fail[state]
+        if fail_state is not None:
+            for char, target in fail_state.transitions.items():
+                if char not in state.transitions:
+                    state.transitions[char] = target
+            state.default_state = fail_state.default_state if fail_state.default_state is not None else fail_state
+        elif state is not init_state:
+            state.default_state = error_state
+        for separator in SEPARATORS:
+            if separator not in state.transitions:
+                state.transitions[separator] = init_state
+        state.transitions[OPEN_TAG] = tag_state
+
+    variants = dict()
+
+    def reached_variant(target, found_ids):
+        key = (target, found_ids)
+        if key not in variants:
+            default_state = target.default_state if target.default_state is not None else target
+            variants[key] = DState.end_state(default_state, found_ids, target.transitions)
+        return variants[key]
+
+    for state in order:
+        found_ids = tuple(sorted(word_ids[state]))
+        if found_ids:
+            for char in SEPARATORS + (OPEN_TAG,):
+                state.transitions[char] = reached_variant(state.transitions[char], found_ids)
+
+    return Automata(init_state)
+
+
+def minimize_automata(automata):
+    """
+    Given a Deterministic Automata, returns an equivalent Deterministic Automata with the least amount of states, using
+    Hopcroft's partition refinement. End states are only merged when they find the same word ids, so every word keeps
+    being counted on its own.
+    :param automata: deterministic automata, as returned by determinize_automata
+    :return: minimal deterministic automata
+    """
+
+    states = get_automata_states(automata)
+    indexes = dict((state, index) for index, state in enumerate(states))
+    keys = sorted({key for state in states for key in state.transitions})
+
+    inverse = []
+    for key in keys + [None]:
+        predecessors = defaultdict(list)
+        for index, state in enumerate(states):
+            if key is None:
+                target = state.default_state if state.default_state is not None else state
+            else:
+                target = state.get(key)
+            predecessors[indexes[target]].append(index)
+        inverse.append(predecessors)
+
+    initial_blocks = defaultdict(set)
+    for index, state in enumerate(states):
+        initial_blocks[(state.is_end_state, state.word_ids)].add(index)
+    blocks = list(initial_blocks.values())
+    block_of = [0] * len(states)
+    for block_index, block in enumerate(blocks):
+        for index in block:
+            block_of[index] = block_index
+
+    pending = set(range(len(blocks)))
+    while pending:
+        splitter = list(blocks[pending.pop()])
+        for predecessors in inverse:
+            touched = defaultdict(set)
+            for target in splitter:
+                for source in predecessors.get(target, ()):
+                    touched[block_of[source]].add(source)
+            for block_index, inside in touched.items():
+                block = blocks[block_index]
+                if len(inside) == len(block):
+                    continue
+                block.difference_update(inside)
+                new_index = len(blocks)
+                blocks.append(inside)
+                for index in inside:
+                    block_of[index] = new_index
+                if block_index in pending or len(inside) <= len(block):
+                    pending.add(new_index)
+                else:
+                    pending.add(block_index)
+
+    new_states = []
+    for block in blocks:
+        representative = states[next(iter(block))]
+        if representative.is_end_state:
+            new_states.append(DState.end_state(None, representative.word_ids))
+        else:
+            new_states.append(DState())
+    for block_index, block in enumerate(blocks):
+        representative = states[next(iter(block))]
+        new_state = new_states[block_index]
+        if representative.default_state is not None:
+            new_state.default_state = new_states[block_of[indexes[representative.default_state]]]
+        for key, target in representative.transitions.items():
+            new_state.transitions[key] = new_states[block_of[indexes[target]]]
+
+    return Automata(new_states[block_of[indexes[automata.init_state]]])
+
+
+def compile_automata(automata):
+    """
+    Given a Deterministic Automata, returns an equivalent TableAutomata. States are numbered with end states first and
+    sink states last, every transition key becomes a character class (class OTHER_CLASS stands for every other char)
+    and each end state gets the ids of the words it finds.
+    :param automata: deterministic automata, as returned by determinize_automata
+    :return: TableAutomata equivalent to the given automata
+    """
+    return TableCompilation(automata).automata
+
+
+def sink_exits(state, keys):
+    """
+    Given a DState, returns the chars leaving it if it loops on every other char, or None if it does not. Only chars
+    without case are accepted as exits, since any case of a char would have to leave the state
+    :param state: DState to check
+    :param keys: transition keys of the whole automata
+    :return: list of exit chars, None if the state is not a sink
+    """
+    if state.default_state is not None and state.default_state is not state:
+        return None
+    exits = [key for key in keys if state.get(key) is not state]
+    if not exits or any(key.lower() != key or key.upper() != key for key in exits):
+        return None
+    return exits
+
+
+def bit_parallel_automata(automata):
+    """
+    Given a Non Deterministic Automata built by add_word, returns an equivalent BitParallelAutomata. Every word path
+    hanging from the init state gets one bit per state, in order, and its last state is the one with separator
+    transitions to the end state of the word. Words with a tag open char never reach it, so their path stops there.
+    :param automata: NDAutomata to simulate
+    :return: BitParallelAutomata equivalent to the given automata
+    """
+
+    paths = []
+    for first_char, heads in automata.init_state.transitions.items():
+        for head in heads:
+            if head is automata.tag_state:
+                continue
+            path = [first_char]
+            state = head
+            while state is not None and ENTER not in state.transitions:
+                char = next((key for key in state.transitions if key != OPEN_TAG), None)
+                state = next(iter(state.transitions[char])) if char is not None else None
+                if state is not None:
+                    path.append(char)
+            word_ids = next(iter(state.transitions[ENTER])).word_ids if state is not None else None
+            paths.append((path, word_ids))
+
+    keys = sorted({char for path, _ in paths for char in path} | set(SEPARATORS) | {OPEN_TAG, CLOSE_TAG})
+    key_classes = dict((key, index + 1) for index, key in enumerate(keys))
+    class_count = len(keys) + 1
+    heads = [0] * class_count
+    advances = [0] * class_count
+    complete_mask = 0
+    bit_words = []
+    for path, word_ids in paths:
+        first_bit = len(bit_words)
+        heads[key_classes[path[0]]] |= 1 << first_bit
+        for index, char in enumerate(path[1:]):
+            if char != OPEN_TAG:
+                advances[key_classes[char]] |= 1 << (first_bit + index + 1)
+        bit_words.extend([word_ids] * len(path))
+        if word_ids is not None:
+            complete_mask |= 1 << (len(bit_words) - 1)
+
+    sep_classes = frozenset(key_classes[separator] for separator in SEPARATORS)
+    return BitParallelAutomata(key_classes, class_count, heads, advances, sep_classes, key_classes[OPEN_TAG],
+                               key_classes[CLOSE_TAG], complete_mask, bit_words)
+
+
+def case_variants(keys):
+    """
+    Given transition keys, returns every char whose upper case is one of them, which are the chars an automata
+    consuming text maps to that key
+    :param keys: transition keys
+    :return: dictionary of key to list of chars
     """
-    return determinize_automata(eliminate_lambdas(automata))
+    folds = case_folds()
+    variants = dict()
+    for key in keys:
+        chars = list(folds.get(key, ()))
+        if key.upper() == key:
+            chars.append(key)
+            chars.sort()
+        variants[key] = chars
+    return variants
+
+
+case_fold_chars = None
+
+
+def case_folds():
+    """
+    Returns every char whose upper case is a different char, by that upper case. Finding them walks every code point,
+    so they are only found once, and compiling an automata again, as an edited vocabulary does, does not walk them again
+    :return: dictionary of upper case char to list of chars
+    """
+    global case_fold_chars
+    if case_fold_chars is None:
+        folds = defaultdict(list)
+        for code in range(sys.maxunicode + 1):
+            if 0xD800 <= code < 0xE000:
+                continue
+            char = chr(code)
+            upper = char.upper()
+            if upper != char and len(upper) == 1:
+                folds[upper].append(char)
+        case_fold_chars = dict(folds)
+    return case_fold_chars
+
+
+def compile_byte_automata(automata):
+    """
+    Given a Deterministic Automata, returns an equivalent TableAutomata consuming UTF-8 encoded bytes. Every char whose
+    upper case is a transition key is encoded into the table, so case folding needs no per char work. Multi-byte chars
+    walk intermediate states and their end state is reported on their last byte. The continuation bytes of any other
+    char keep the state its first byte leads to, and malformed sequences are consumed like any other char.
+    :param automata: deterministic automata, as returned by determinize_automata
+    :return: TableAutomata with byte classes, equivalent to the given automata on UTF-8 text
+    """
+    return TableCompilation(automata, binary=True).automata
+
+
+ACCEPT_REGION = 0
+MIDDLE_REGION = 1
+SINK_REGION = 2
+
+
+class TableCompilation:
+    """
+    Compiles a Deterministic Automata into a TableAutomata, keeping the offset of the row of every state, so an edit of
+    the automata writes again only the rows it changes instead of compiling it again.
+    Rows are laid out in three regions, end states up to accept_limit, sink states from sink_limit on and every other
+    row in between. Compiling with spare rows leaves that many free rows at the end of the first two regions, and sink
+    rows are appended to the table, so the states an edit builds get rows without moving any other. Rows of forgotten
+    states are freed, to be given to the next states built. The table, accepts and sink patterns of the automata are
+    patched in place, so the automata is kept, and a scan goes on from a state offset it already holds.
+    """
+
+    def __init__(self, automata, binary=False, spare=0):
+        states = get_automata_states(automata)
+        self.binary = binary
+        self.keys = sorted({key for state in states for key in state.transitions})
+        self.key_set = set(self.keys)
+        self.offsets = dict()
+        self.paths = dict()
+        self.prefixes = dict()
+        self.dependents = defaultdict(set)
+        self.free_rows = ([], [], [])
+        if binary:
+            self.classify_bytes()
+        else:
+            self.key_classes = dict((key, index + 1) for index, key in enumerate(self.keys))
+            self.class_count = len(self.keys) + 1
+            self.multi_byte_keys = frozenset()
+
+        regions = ([], [], [])
+        exits = dict()
+        for state in states:
+            if binary:
+                self.set_paths(state)
+            exits[state] = self.state_exits(state)
+            regions[self.region(state, exits[state])].append(state)
+        end_states, middle_states, sinks = regions
+        prefixes = [item for state in states for item in self.prefix_items(state)]
+        # (state, b'') copies an end state without reporting it, kept while the rest of its last char is consumed
+        copies = [(state, b'') for state in end_states] if binary else []
+        items = end_states + [None] * spare + middle_states + prefixes + copies + [None] * spare + sinks
+        class_count = self.class_count
+        for index, item in enumerate(items):
+            if item is not None:
+                self.offsets[item] = index * class_count
+            else:
+                self.free_rows[ACCEPT_REGION if index < len(end_states) + spare else MIDDLE_REGION].append(
+                    index * class_count)
+
+        self.table = array('l')
+        rows = dict() if binary else None
+        for item in items:
+            if item is None:
+                self.table.extend([0] * class_count)
+            elif isinstance(item, tuple):
+                state, prefix = item
+                self.table.extend(self.prefix_row(state, prefix, rows) if prefix else self.char_row(state, rows))
+            else:
+                self.table.extend(self.char_row(item, rows))
+        self.accepts = [state.word_ids for state in end_states] + [()] * spare
+        self.accept_limit = len(self.accepts) * class_count
+        self.sink_limit = (len(items) - len(sinks)) * class_count
+        self.sink_patterns = [self.sink_pattern(exits[state]) for state in sinks]
+        self.automata = TableAutomata(self.offsets[automata.init_state], self.table, class_count, self.key_classes,
+                                      self.accept_limit, self.accepts, self.sink_limit, self.sink_patterns,
+                                      bytes(self.byte_classes) if binary else None)
+
+    def classify_bytes(self):
+        """
+        Gives a class to every byte: one per key for the single byte chars whose upper case is a key, one per byte of
+        the multi-byte ones, and a class for the continuation and the lead bytes of any other char
+        """
+        sequences = dict()
+        for key, chars in case_variants(self.keys).items():
+            for char in chars:
+                sequences[char.encode('utf-8')] = key
+        multi_byte = sorted(sequence for sequence in sequences if len(sequence) > 1)
+
+        byte_classes = [OTHER_CLASS] * 256
+        key_classes = dict()
+        for sequence, key in sorted(sequences.items()):
+            if len(sequence) == 1:
+                byte_classes[sequence[0]] = key_classes.setdefault(key, len(key_classes) + 1)
+        class_count = len(key_classes) + 1
+        for byte in sorted({byte for sequence in multi_byte for byte in sequence}):
+            byte_classes[byte] = class_count
+            class_count += 1
+        continuation_class, lead_class = class_count, class_count + 1
+        class_count += 2
+        if class_count > 256:
+            raise ValueError('{} byte classes do not fit a byte table'.format(class_count))
+        for byte in range(0x80, 0x100):
+            if byte_classes[byte] == OTHER_CLASS:
+                byte_classes[byte] = continuation_class if byte < 0xC0 else lead_class
+        self.sequences = sequences
+        self.multi_byte = multi_byte
+        self.multi_byte_keys = frozenset(sequences[sequence] for sequence in multi_byte)
+        self.byte_classes = byte_classes
+        self.key_classes = key_classes
+        self.class_count = class_count
+        self.continuation_classes = sorted({byte_classes[byte] for byte in range(0x80, 0xC0)})
+
+    @staticmethod
+    def other(state):
+        return state.default_state if state.default_state is not None else state
+
+    def set_paths(self, state):
+        """
+        Finds the multi-byte chars leading a state somewhere else than its other chars, keeping them in paths, by
+        sequence, and the items of their prefixes in prefixes, for the states with any
+        :param state: DState
+        """
+        other = self.other(state)
+        paths = dict((sequence, state.get(self.sequences[sequence])) for sequence in self.multi_byte
+                     if state.get(self.sequences[sequence]) is not other)
+        if paths:
+            self.paths[state] = paths
+            self.prefixes[state] = list(dict.fromkeys((state, sequence[:end]) for sequence in paths
+                                                      for end in range(1, len(sequence))))
+            if other is not state:
+                self.dependents[other].add(state)
+        elif state in self.paths:
+            del self.paths[state]
+            del self.prefixes[state]
+            self.dependents[other].discard(state)
+
+    def prefix_items(self, state):
+        return self.prefixes.get(state, [])
+
+    def state_exits(self, state):
+        """
+        Given a state, returns the chars leaving it if it is a sink. In a byte table only the states without paths and
+        leaving through single byte chars are sinks
+        :param state: DState
+        :return: list of exit chars, None if the state is not a sink
+        """
+        if state.is_end_state or state in self.paths:
+            return None
+        exits = sink_exits(state, self.keys)
+        if exits is None or self.binary and any(ord(key) >= 0x80 for key in exits):
+            return None
+        return exits
+
+    @staticmethod
+    def region(state, exits):
+        if state.is_end_state:
+            return ACCEPT_REGION
+        return MIDDLE_REGION if exits is None else SINK_REGION
+
+    def offset_region(self, offset):
+        if offset < self.accept_limit:
+            return ACCEPT_REGION
+        return MIDDLE_REGION if offset < self.sink_limit else SINK_REGION
+
+    def sink_pattern(self, exits):
+        if self.binary:
+            return re.compile(b'[' + re.escape(''.join(exits).encode('ascii')) + b']')
+        return re.compile('[{}]'.format(re.escape(''.join(exits))))
+
+    def char_row(self, state, rows=None):
+        """
+        Given a state, returns the row it consumes chars, or bytes, with
+        :param state: DState
+        :param rows: dictionary memoizing the rows of a byte table while it is written, None to not memoize them
+        :return: list of offsets, by class
+        """
+        offsets = self.offsets
+        if not self.binary:
+            get = state.get
+            return [offsets[self.other(state)]] + [offsets[get(key)] for key in self.keys]
+        if rows is not None and state in rows:
+            return rows[state]
+        row = [offsets[self.other(state)]] * self.class_count
+        for key, key_class in self.key_classes.items():
+            row[key_class] = offsets[state.get(key)]
+        stay = offsets[(state, b'')] if state.is_end_state else offsets[state]
+        for char_class in self.continuation_classes:
+            row[char_class] = stay
+        for sequence in self.paths.get(state, ()):
+            row[self.byte_classes[sequence[0]]] = offsets[(state, sequence[:1])]
+        if rows is not None:
+            rows[state] = row
+        return row
+
+    def prefix_row(self, state, prefix, rows=None):
+        """
+        Given a state and the first bytes of a multi-byte char leaving it, returns the row consuming the next byte
+        :param state: DState
+        :param prefix: bytes consumed of the char
+        :param rows: dictionary memoizing the rows of the table while it is written, None to not memoize them
+        :return: list of offsets, by class
+        """
+        other = self.other(state)
+        row = list(self.char_row(other, rows))
+        for char_class in self.continuation_classes:
+            row[char_class] = self.offsets[other]
+        for sequence, target in self.paths[state].items():
+            if len(sequence) > len(prefix) and sequence.startswith(prefix):
+                following = sequence[:len(prefix) + 1]
+                following_state = target if following == sequence else (state, following)
+                row[self.byte_classes[following[-1]]] = self.offsets[following_state]
+        return row
+
+    def patch(self, key, changed_states, evicted_states=()):
+        """
+        Writes again the rows of the states whose transition for a key changed, giving rows to the states they now
+        lead to for the first time, and frees the rows of the forgotten states. An edit using a new key, changing the
+        region of a state or running out of spare rows can not be patched, and the automata has to be compiled again
+        :param key: transition key whose targets changed
+        :param changed_states: DStates whose transition for the key changed
+        :param evicted_states: DStates no longer reached by the automata, nor by any later edit
+        :return: whether the table was patched
+        """
+        if key not in self.key_set:
+            return False
+        for state in evicted_states:
+            if state in self.offsets:
+                self.free(state)
+        # a key with multi-byte chars changes the paths of the states, so their rows are written whole
+        whole = key in self.multi_byte_keys or key not in self.key_classes
+        changed = []
+        for state in changed_states:
+            offset = self.offsets.get(state)
+            if offset is None:
+                continue
+            if whole and not self.replace_prefixes(state):
+                return False
+            if not state.is_end_state:
+                exits = self.state_exits(state)
+                if self.region(state, exits) != self.offset_region(offset):
+                    return False
+                if exits is not None:
+                    self.sink_patterns[(offset - self.sink_limit) // self.class_count] = self.sink_pattern(exits)
+            changed.append(state)
+
+        placed = []
+        if whole:
+            pending = list({target for state in changed for target in state_targets(state)})
+        else:
+            pending = list({state.get(key) for state in changed})
+        while pending:
+            state = pending.pop()
+            if state in self.offsets:
+                continue
+            if not self.place(state):
+                return False
+            placed.append(state)
+            pending.extend(state_targets(state))
+
+        rows = dict() if self.binary else None
+        written = set(placed)
+        if whole:
+            written.update(changed)
+        else:
+            table = self.table
+            offsets = self.offsets
+            column = self.key_classes[key]
+            for state in changed:
+                target = offsets[state.get(key)]
+                table[offsets[state] + column] = target
+                if self.binary:
+                    if state.is_end_state:
+                        table[offsets[(state, b'')] + column] = target
+                    # the prefix rows of the states falling back to this one copy its row
+                    if self.dependents.get(state) or state.default_state is None and state in self.paths:
+                        for dependent in self.prefix_dependents(state):
+                            for item in self.prefix_items(dependent):
+                                table[offsets[item] + column] = target
+        for state in written:
+            self.write_rows(state, rows)
+        for state in written:
+            for dependent in self.dependents.get(state, ()):
+                if dependent not in written:
+                    for item in self.prefix_items(dependent):
+                        self.write_row(item, self.prefix_row(dependent, item[1], rows))
+        return True
+
+    def prefix_dependents(self, state):
+        dependents = list(self.dependents.get(state, ()))
+        if state in self.paths and state.default_state is None:
+            dependents.append(state)
+        return dependents
+
+    def place(self, state):
+        """
+        Gives rows to a state reached for the first time
+        :param state: DState
+        :return: whether it got its rows, False if it uses a new key or there are no spare rows left
+        """
+        if any(key not in self.key_set for key in state.transitions):
+            return False
+        if self.binary:
+            self.set_paths(state)
+        exits = self.state_exits(state)
+        offset = self.allocate(self.region(state, exits))
+        if offset is None:
+            return False
+        self.offsets[state] = offset
+        if state.is_end_state:
+            self.accepts[offset // self.class_count] = state.word_ids
+        elif exits is not None:
+            self.sink_patterns[(offset - self.sink_limit) // self.class_count] = self.sink_pattern(exits)
+        items = self.prefix_items(state) + ([(state, b'')] if self.binary and state.is_end_state else [])
+        for item in items:
+            offset = self.allocate(MIDDLE_REGION)
+            if offset is None:
+                return False
+            self.offsets[item] = offset
+        return True
+
+    def replace_prefixes(self, state):
+        previous = self.prefix_items(state)
+        self.set_paths(state)
+        items = self.prefix_items(state)
+        for item in previous:
+            if item not in items:
+                self.free_rows[MIDDLE_REGION].append(self.offsets.pop(item))
+        for item in items:
+            if item not in self.offsets:
+                offset = self.allocate(MIDDLE_REGION)
+                if offset is None:
+                    return False
+                self.offsets[item] = offset
+        return True
+
+    def allocate(self, region):
+        """
+        Returns the offset of a free row of a region, appending a row for a sink
+        :param region: ACCEPT_REGION, MIDDLE_REGION or SINK_REGION
+        :return: row offset, None if the region has no free rows left
+        """
+        if self.free_rows[region]:
+            return self.free_rows[region].pop()
+        if region != SINK_REGION:
+            return None
+        self.table.extend([0] * self.class_count)
+        self.sink_patterns.append(None)
+        return len(self.table) - self.class_count
+
+    def free(self, state):
+        for item in self.prefix_items(state) + ([(state, b'')] if self.binary and state.is_end_state else []):
+            self.free_rows[MIDDLE_REGION].append(self.offsets.pop(item))
+        if state in self.paths:
+            del self.paths[state]
+            del self.prefixes[state]
+            self.dependents[self.other(state)].discard(state)
+        self.dependents.pop(state, None)
+        offset = self.offsets.pop(state)
+        self.free_rows[self.offset_region(offset)].append(offset)
+
+    def write_row(self, item, row):
+        offset = self.offsets[item]
+        self.table[offset:offset + self.class_count] = array('l', row)
+
+    def write_rows(self, state, rows=None):
+        row = self.char_row(state, rows)
+        self.write_row(state, row)
+        if self.binary:
+            if state.is_end_state:
+                self.write_row((state, b''), row)
+            for item in self.prefix_items(state):
+                self.write_row(item, self.prefix_row(state, item[1], rows))
@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from automata_util import *
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+TAGS = ['p', 'div', 'span', 'a', 'li', 'h1', 'td']
+
+
+def generate_words(amount, seed=0, min_length=3, max_length=10):
+    """
+    Generates a reproducible vocabulary of random lowercase words
+    :param amount: amount of distinct words
+    :param seed: random seed
+    :param min_length: minimum word length
+    :param max_length: maximum word length
+    :return: sorted list of words
+    """
+    generator = random.Random(seed)
+    words = set()
+    while len(words) < amount:
+        length = generator.randint(min_length, max_length)
+        words.add(''.join(generator.choice(LETTERS) for _ in range(length)))
+    return sorted(words)
+
+
+def generate_html(words, size, seed=0, word_ratio=0.2, tag_ratio=0.2):
+    """
+    Generates a reproducible html document mixing tags, vocabulary words and random filler words
+    :param words: vocabulary words
+    :param size: approximate amount of characters
+    :param seed: random seed
+    :param word_ratio: probability of each token being a vocabulary word
+    :param tag_ratio: probability of each token being a tag
+    :return: html text
+    """
+    generator = random.Random(seed)
+    tokens = ['<html><body>\n']
+    length = 0
+    while length < size:
+        roll = generator.random()
+        if roll < tag_ratio:
+            tag = generator.choice(TAGS)
+            if roll < tag_ratio / 2:
+                token = '<{} class="c{}">'.format(tag, generator.randint(0, 99))
+            else:
+                token = '</{}>'.format(tag)
+        elif roll < tag_ratio + word_ratio:
+            token = generator.choice(words)
+        else:
+            token = ''.join(generator.choice(LETTERS) for _ in range(generator.randint(1, 9)))
+        token += generator.choice(' ,.\n ')
+        tokens.append(token)
+        length += len(token)
+    tokens.append('</body></html>\n')
+    return ''.join(tokens)
+
+
+def write_corpus(directory, words, file_amount, file_size, seed=0):
+    """
+    Writes a generated vocabulary as words.txt and file_amount generated html files into a directory, so tpe can be
+    run over them
+    :param directory: directory to write into
+    :param words: vocabulary words
+    :param file_amount: amount of html files
+    :param file_size: approximate amount of characters per file
+    :param seed: random seed, each file uses a different one derived from it
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'words.txt'), 'w') as file:
+        file.write('\n'.join(words) + '\n')
+    for index in range(file_amount):
+        with open(os.path.join(directory, 'page{:05d}.html'.format(index)), 'w') as file:
+            file.write(generate_html(words, file_size, seed * 100003 + index))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def peak_memory(function, *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def build_nfa(words):
+    nd_automata = NDAutomata()
+    with gc_paused():
+        for word_id, word in enumerate(words):
+            nd_automata.add_word(word, word_id)
+    return nd_automata
+
+
+def build_all(words):
+    nd_automata = build_nfa(words)
+    with gc_paused():
+        return determinize_automata(nd_automata)
+
+
+def count_transitions(states):
+    total = 0
+    for state in states:
+        for targets in state.transitions.values():
+            total += len(targets) if isinstance(state, NDState) else 1
+    return total
+
+
+def scan_throughput(automata, text, word_amount):
+    """
+    Scans a text with an automata counting every match
+    :return: throughput in MB/s and amount of matches
+    """
+    counts = [0] * word_amount
+
+    def count(text):
+        for _, word_ids in automata.find_stream(text):
+            for word_id in word_ids:
+                counts[word_id] += 1
+
+    automata.reset()
+    _, seconds = timed(count, text)
+    return len(text.encode('utf-8')) / seconds / 1e6, sum(counts)
+
+
+def run_benchmark(word_amount, corpus_size, seed=0, memory=True, nfa_scan_size=None):
+    """
+    Builds the automata for a generated vocabulary, measuring every phase, and scans a generated corpus with each of
+    them
+    :param word_amount: amount of vocabulary words
+    :param corpus_size: approximate amount of characters of the corpus
+    :param seed: random seed for the vocabulary and the corpus
+    :param memory: whether to measure peak memory of the build phases, which builds everything twice
+    :param nfa_scan_size: amount of characters scanned with the NDAutomata, all of them when None
+    :return: dictionary of measurements
+    """
+    words = generate_words(word_amount, seed)
+    text = generate_html(words, corpus_size, seed)
+
+    nd_automata, nfa_seconds = timed(build_nfa, words)
+    nfa_states = get_automata_states(nd_automata)
+    with gc_paused():
+        d_automata, dfa_seconds = timed(determinize_automata, nd_automata)
+    dfa_states = get_automata_states(d_automata)
+    table, compile_seconds = timed(compile_automata, d_automata)
+
+    result = dict(
+        words=word_amount,
+        corpus_bytes=len(text.encode('utf-8')),
+        nfa_build_seconds=nfa_seconds,
+        determinize_seconds=dfa_seconds,
+        compile_seconds=compile_seconds,
+        nfa_states=len(nfa_states),
+        nfa_transitions=count_transitions(nfa_states),
+        dfa_states=len(dfa_states),
+        dfa_transitions=count_transitions(dfa_states),
+    )
+    if memory:
+        result['nfa_build_peak_bytes'] = peak_memory(build_nfa, words)
+        result['full_build_peak_bytes'] = peak_memory(build_all, words)
+
+    nfa_text = text if nfa_scan_size is None else text[:nfa_scan_size]
+    for name, automata, scanned in (('nfa', nd_automata, nfa_text), ('dfa', d_automata, text), ('table', table, text)):
+        throughput, matches = scan_throughput(automata, scanned, word_amount)
+        result['{}_scan_mb_per_second'.format(name)] = throughput
+        result['{}_matches'.format(name)] = matches
+    return result
+
+
+def current_commit():
+    try:
+        output = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark automata construction and scanning')
+    parser.add_argument('--words', type=int, nargs='+', default=[1000, 10000], help='vocabulary sizes to measure')
+    parser.add_argument('--corpus-size', type=int, default=1000000, help='characters of generated html')
+    parser.add_argument('--nfa-scan-size', type=int, default=100000, help='characters scanned with the NDAutomata')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip peak memory measurement')
+    parser.add_argument('--output', help='JSON file to write, stdout when missing')
+    parser.add_argument('--write-corpus', metavar='DIRECTORY',
+                        help='only write a generated corpus for the first vocabulary size into DIRECTORY')
+    parser.add_argument('--files', type=int, default=100, help='html files of the written corpus')
+    arguments = parser.parse_args()
+
+    if arguments.write_corpus is not None:
+        words = generate_words(arguments.words[0], arguments.seed)
+        write_corpus(arguments.write_corpus, words, arguments.files, arguments.corpus_size, arguments.seed)
+        return
+
+    report = dict(
+        commit=current_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        seed=arguments.seed,
+        corpus_size=arguments.corpus_size,
+        results=[run_benchmark(amount, arguments.corpus_size, arguments.seed, not arguments.no_memory,
+                               arguments.nfa_scan_size) for amount in arguments.words],
+    )
+    if arguments.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(arguments.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
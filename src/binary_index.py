@@ -0,0 +1,153 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from index_util import read_results
+
+MAGIC = b'TPEINDEX'
+VERSION = 1
+HEADER = struct.Struct('<8sIII6Q')
+OFFSET = struct.Struct('<Q')
+
+
+def little_endian(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def aligned(file):
+    padding = -file.tell() % 8
+    file.write(b'\0' * padding)
+    return file.tell()
+
+
+def write_binary_index(results, path):
+    """
+    Given results, writes them as a binary inverted index: a sorted term dictionary and, for every term, a packed
+    posting list of (file id, count) pairs sorted by file id. Every section is 8 byte aligned and little endian, and
+    the header holds where each one starts, so the index can be read through mmap without loading it.
+    :param results: dictionary of word to a dictionary of file to count
+    :param path: path of the binary index
+    """
+    html_files = sorted({html_file for html_dict in results.values() for html_file in html_dict})
+    file_ids = dict((html_file, file_id) for file_id, html_file in enumerate(html_files))
+    terms = sorted(results, key=lambda term: term.encode('utf-8'))
+
+    temp_path = '{}.tmp'.format(path)
+    with open(temp_path, 'wb') as file:
+        file.write(b'\0' * HEADER.size)
+        sections = []
+        for names in (html_files, terms):
+            blob = [name.encode('utf-8') for name in names]
+            offsets = array('Q', [0])
+            for name in blob:
+                offsets.append(offsets[-1] + len(name))
+            sections.append(aligned(file))
+            file.write(little_endian(offsets).tobytes())
+            sections.append(aligned(file))
+            file.write(b''.join(blob))
+
+        posting_offsets = array('Q', [0])
+        for term in terms:
+            posting_offsets.append(posting_offsets[-1] + len(results[term]))
+        sections.append(aligned(file))
+        file.write(little_endian(posting_offsets).tobytes())
+        sections.append(aligned(file))
+        for term in terms:
+            postings = array('I')
+            for file_id, count in sorted((file_ids[html_file], count) for html_file, count in results[term].items()):
+                postings.append(file_id)
+                postings.append(count)
+            file.write(little_endian(postings).tobytes())
+
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, VERSION, len(terms), len(html_files), *sections))
+    os.replace(temp_path, path)
+
+
+def convert_text_index(text_path, binary_path):
+    """
+    Converts an index written by write_results into a binary inverted index
+    :param text_path: path of the text index
+    :param binary_path: path of the binary index to write
+    """
+    write_binary_index(read_results(text_path), binary_path)
+
+
+class BinaryIndex:
+    """
+    Read only view of a binary inverted index through mmap. Terms are found with a binary search over the sorted term
+    dictionary, so a lookup only touches the pages of the terms compared and of its own posting list.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.term_count, self.file_count, *sections = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('{} is not a version {} binary index'.format(path, VERSION))
+        (self.file_offsets, self.file_blob, self.term_offsets, self.term_blob, self.posting_offsets,
+         self.postings_start) = sections
+
+    def close(self):
+        if not self.map.closed:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.term_count
+
+    def __offset(self, section, index):
+        return OFFSET.unpack_from(self.map, section + 8 * index)[0]
+
+    def __name(self, offsets, blob, index):
+        start = blob + self.__offset(offsets, index)
+        end = blob + self.__offset(offsets, index + 1)
+        return self.map[start:end]
+
+    def term(self, term_id):
+        return self.__name(self.term_offsets, self.term_blob, term_id).decode('utf-8')
+
+    def file_name(self, file_id):
+        return self.__name(self.file_offsets, self.file_blob, file_id).decode('utf-8')
+
+    def find(self, term):
+        """
+        Given a term returns its id
+        :param term: term to look for
+        :return: term id, None if the term is not in the index
+        """
+        key = term.encode('utf-8')
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.__name(self.term_offsets, self.term_blob, middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self.__name(self.term_offsets, self.term_blob, low) == key:
+            return low
+        return None
+
+    def postings(self, term):
+        """
+        Given a term returns its posting list
+        :param term: term to look for
+        :return: list of file id - count tuples sorted by file id, empty if the term is not in the index
+        """
+        term_id = self.find(term)
+        if term_id is None:
+            return []
+        start = self.postings_start + 8 * self.__offset(self.posting_offsets, term_id)
+        end = self.postings_start + 8 * self.__offset(self.posting_offsets, term_id + 1)
+        values = little_endian(array('I', self.map[start:end]))
+        return list(zip(values[0::2], values[1::2]))
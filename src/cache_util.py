@@ -0,0 +1,68 @@
+import hashlib
+import os
+import pickle
+
+CACHE_VERSION = 5
+
+
+def vocabulary_key(search_file, *options):
+    """
+    Given a search file and the options used to build its automata, returns the key of the cached automata
+    :param search_file: path of the file with the searched words
+    :param options: build options changing the resulting automata
+    :return: hexadecimal digest of the cache version, the options and the search file contents
+    """
+    return vocabularies_key([search_file], *options)
+
+
+def vocabularies_key(search_files, *options):
+    """
+    Given the search files of an automata finding the words of all of them and the options used to build it, returns
+    the key of the cached automata. A single search file has the same key vocabulary_key gives it.
+    :param search_files: paths of the files with the searched words
+    :param options: build options changing the resulting automata
+    :return: hexadecimal digest of the cache version, the options and the search files contents
+    """
+    digest = hashlib.sha256('{}:{}\n'.format(CACHE_VERSION, ':'.join(str(option) for option in options)).encode())
+    for number, search_file in enumerate(search_files):
+        if number > 0:
+            digest.update(b'\0')
+        with open(search_file, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 16), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, '{}.automata'.format(key))
+
+
+def load_automata(path):
+    """
+    Given a cache file path returns the cached automata and the words its ids refer to
+    :param path: path of the cache file
+    :return: automata - words tuple, None if there is no usable cache in path
+    """
+    try:
+        with open(path, 'rb') as file:
+            version, words, automata = pickle.load(file)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+    if version != CACHE_VERSION:
+        return None
+    return automata, words
+
+
+def save_automata(path, automata, words):
+    """
+    Saves an automata and the words its ids refer to in a cache file. The file is written aside and then moved, so
+    readers never see a partially written cache.
+    :param path: path of the cache file
+    :param automata: automata whose state only holds picklable values, such as a TableAutomata
+    :param words: list of words indexed by word id
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as file:
+        pickle.dump((CACHE_VERSION, words, automata), file, pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
@@ -0,0 +1,230 @@
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from tpe import *
+from query import lookup, query_all, query_any, top_files
+
+
+class IndexDaemon:
+    """
+    Keeps the automata of a vocabulary and the results of a directory in memory. refresh indexes the html files that
+    changed since the last one and forgets the removed ones, and in between the results can be queried like a
+    BinaryIndex, through postings and file_name.
+    Refreshes are serialized and build the new results on a copy, so queries only wait for a refresh while the copy
+    replaces the current results.
+    """
+
+    def __init__(self, automata, word_counter, directory, vocabulary, workers=1, recursive=False, read_ahead=0):
+        self.automata = automata
+        self.word_counter = word_counter
+        self.directory = directory
+        self.vocabulary = vocabulary
+        self.workers = workers
+        self.recursive = recursive
+        self.read_ahead = read_ahead
+        self.index_file = build_path(directory, 'index.txt')
+        self.manifest_file = build_path(directory, 'index.manifest')
+        self.results = defaultdict(dict)
+        self.entries = dict()
+        self.file_ids = dict()
+        self.file_names = []
+        self.refreshes = 0
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the index and manifest left in the directory by an incremental run or a previous daemon, if they were
+        built for the same vocabulary, so only the files changed since then are scanned by the first refresh
+        :return: whether they were loaded
+        """
+        index = load_index(self.index_file, self.manifest_file, self.vocabulary)
+        if index is None:
+            return False
+        results, entries = index
+        with self.lock:
+            self.results = results
+            self.entries = entries
+        return True
+
+    def refresh(self):
+        """
+        Indexes the html files that changed since the last refresh and forgets the removed ones, saving the index and
+        its manifest when something changed.
+        Files that cannot be scanned are logged and left out of the results, and are not scanned again until they
+        change.
+        :return: tuple of scanned files and removed files
+        """
+        with self.refresh_lock:
+            paths = dict((html_file, build_path(self.directory, html_file))
+                         for html_file in list_html_files(self.directory, self.recursive))
+            to_scan, removed, entries = changed_files(self.entries, paths)
+            new_results = consume_files(self.automata, self.word_counter, self.directory, to_scan, self.workers,
+                                        read_ahead=self.read_ahead, on_error=self.skip_file)
+            results = self.results
+            if to_scan or removed:
+                # only refreshes change the results, so they can be copied without the lock queries take
+                results = defaultdict(dict, ((word, dict(html_dict)) for word, html_dict in self.results.items()))
+                drop_files(results, to_scan + removed)
+                merge_results(results, new_results)
+            with self.lock:
+                self.results = results
+                self.entries = entries
+                self.refreshes += 1
+            if to_scan or removed:
+                write_results(results, self.index_file)
+                save_manifest(self.manifest_file, self.vocabulary, entries)
+            return to_scan, removed
+
+    def skip_file(self, html_file, error):
+        print('Skipped {}: {}'.format(html_file, error), file=sys.stderr)
+
+    def postings(self, term):
+        """
+        Given a term returns its posting list
+        :param term: searched term
+        :return: list of file id - count tuples sorted by file id
+        """
+        with self.lock:
+            html_dict = self.results.get(term)
+            if html_dict is None:
+                return []
+            return sorted((self.file_id(html_file), count) for html_file, count in html_dict.items())
+
+    def file_id(self, html_file):
+        file_id = self.file_ids.get(html_file)
+        if file_id is None:
+            file_id = len(self.file_names)
+            self.file_ids[html_file] = file_id
+            self.file_names.append(html_file)
+        return file_id
+
+    def file_name(self, file_id):
+        return self.file_names[file_id]
+
+    def status(self):
+        with self.lock:
+            return dict(files=len(self.entries), words=len(self.results), refreshes=self.refreshes)
+
+
+def watch(daemon, interval, stopped):
+    """
+    Refreshes the daemon every interval seconds until stopped is set. The directory is polled, since the standard
+    library has no portable way of being notified of file changes
+    :param daemon: IndexDaemon to refresh
+    :param interval: seconds between refreshes
+    :param stopped: threading.Event stopping the watch
+    """
+    while not stopped.wait(interval):
+        try:
+            daemon.refresh()
+        except Exception as error:
+            print('Refresh failed: {}'.format(error), file=sys.stderr)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answers queries about the results of the server IndexDaemon with JSON:
+    GET /lookup?term=T lists the files containing T and their counts.
+    GET /query?term=T&term=U lists the files containing every term, or any of them with any=1, top=N keeps the N
+    files with the highest counts.
+    GET /status returns the amount of files and words indexed.
+    POST /reindex refreshes the daemon right away and lists the scanned and removed files.
+    """
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, so Nagle's algorithm would delay every answer on a kept alive connection
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parameters = parse_qs(url.query)
+        daemon = self.server.index_daemon
+        terms = parameters.get('term', [])
+        if url.path == '/lookup' and len(terms) == 1:
+            self.send_json(200, lookup(daemon, terms[0]))
+        elif url.path == '/query' and terms:
+            matches = query_any(daemon, terms) if parameters.get('any') == ['1'] else query_all(daemon, terms)
+            if 'top' in parameters:
+                try:
+                    matches = top_files(matches, int(parameters['top'][0]))
+                except ValueError:
+                    self.send_json(400, dict(error='top must be an integer'))
+                    return
+            self.send_json(200, matches)
+        elif url.path == '/status':
+            self.send_json(200, daemon.status())
+        else:
+            self.send_json(404, dict(error='unknown query'))
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/reindex':
+            self.send_json(404, dict(error='unknown query'))
+            return
+        try:
+            scanned, removed = self.server.index_daemon.refresh()
+        except Exception as error:
+            self.send_json(500, dict(error='refresh failed: {}'.format(error)))
+            return
+        self.send_json(200, dict(scanned=scanned, removed=removed))
+
+    def send_json(self, status, value):
+        body = json.dumps(value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(daemon, port, interval):
+    """
+    Answers queries on a loopback port while watching the daemon directory, until interrupted
+    :param daemon: IndexDaemon to query and refresh
+    :param port: loopback port to listen on
+    :param interval: seconds between directory polls
+    """
+    stopped = threading.Event()
+    watcher = threading.Thread(target=watch, args=(daemon, interval, stopped), daemon=True)
+    with ThreadingHTTPServer(('127.0.0.1', port), QueryHandler) as server:
+        server.index_daemon = daemon
+        watcher.start()
+        print('Serving {} on http://127.0.0.1:{}'.format(daemon.directory, server.server_address[1]), file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stopped.set()
+    watcher.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep an index up to date and answer queries about it')
+    add_index_arguments(parser)
+    parser.add_argument('--port', type=int, default=8765, help='loopback port answering queries')
+    parser.add_argument('--interval', type=float, default=2.0, help='seconds between directory polls')
+    arguments = parser.parse_args()
+    check_index_arguments(parser, arguments)
+
+    directory = arguments.directory
+    search_file = build_path(directory, arguments.search_file)
+    if not search_file.endswith('.txt'):
+        sys.exit('Invalid search file')
+
+    automata, word_counter = prepare_automata(arguments, directory, [search_file])
+    vocabulary = vocabulary_key(search_file, arguments.engine, arguments.bytes)
+    daemon = IndexDaemon(automata, word_counter, directory, vocabulary, arguments.workers, arguments.recursive,
+                         arguments.read_ahead)
+    daemon.load()
+    scanned, removed = daemon.refresh()
+    print('Indexed {} files'.format(len(scanned)), file=sys.stderr)
+    serve(daemon, arguments.port, arguments.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,26 @@
+import bz2
+import gzip
+import lzma
+import queue
+import threading
 from collections import namedtuple
+from functools import partial
 from automata import DState, NDState, SPACE, LAMBDA, ENTER
 
+CHUNK_SIZE = 1 << 20
+READ_AHEAD = 16 << 20
+READ_AHEAD_THREADS = 4
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
 ProcessedTransition = namedtuple('transition', 'to key')
 ProcessedState = namedtuple('state', 'id is_end transitions')
 
 
 def process_states(states):
     """
-    Takes a list of states and returns a generator with their equivalent, ready to be graphed.
-    :param states: list of states
+    Takes states and returns a generator with their equivalent, ready to be graphed. States are processed one at a
+    time, so only their ids are held.
+    :param states: iterable of states
     :return: generator of processed states
     """
     id_dict = dict()
@@ -27,7 +39,7 @@ def process_states(states):
         elif a_key == SPACE:
             return 'SPC'
         else:
-            return key
+            return a_key
 
     for state in states:
         state_id = get_state_id(state)
@@ -41,21 +53,22 @@ def process_states(states):
                 for transition in to:
                     trans_id = get_state_id(transition)
                     transition_list.append(ProcessedTransition(trans_id, actual_key))
-            if state.default_state is not None:
-                default_id = get_state_id(state.default_state)
-                transition_list.append(ProcessedTransition(default_id, 'OTHER'))
-            else:
-                transition_list.append(ProcessedTransition(state_id, 'OTHER'))
+        if state.default_state is not None:
+            default_id = get_state_id(state.default_state)
+            transition_list.append(ProcessedTransition(default_id, 'OTHER'))
+        else:
+            transition_list.append(ProcessedTransition(state_id, 'OTHER'))
         yield ProcessedState(state_id, state.is_end_state, transition_list)
 
 
 def write_automata(states, path):
     """
-    Given states and a file path writes the graphviz specification of the states
-    :param states: list of automata states
+    Given states and a file path writes the graphviz specification of the states. Every state is written with its
+    transitions as soon as it is processed, so nothing but the file grows with the amount of states.
+    Transitions to states that are not given, such as the ones past a depth limit, lead to unlabeled nodes.
+    :param states: iterable of processed states
     :param path: path to save file
     """
-    transitions = []
     with open(path, 'w+', encoding='utf-8') as file:
         file.write("digraph { \n")
         file.write("rankdir = \"LR\" \n")
@@ -63,11 +76,145 @@ def write_automata(states, path):
             shape = "circle"
             if state.is_end:
                 shape = "doublecircle"
-            file.write("node [shape={}] Node{} [label=\"{}\"];\n".format(shape, state.id, state.id))
-            for transition in state.transitions:
-                transitions.append("Node{} -> Node{} [label=\"{}\"];\n".format(state.id, transition.to, transition.key))
-
-        file.write("\n\n")
-        for transition_str in set(transitions):
-            file.write(transition_str)
-        file.write("\n}")
+            file.write("Node{} [shape={}, label=\"{}\"];\n".format(state.id, shape, state.id))
+            for transition in dict.fromkeys(state.transitions):
+                file.write("Node{} -> Node{} [label=\"{}\"];\n".format(state.id, transition.to, transition.key))
+        file.write("}\n")
+
+
+def open_input(path, binary=False):
+    """
+    Opens a file for reading, decompressing it while it is read when its extension is the one of a compressed format
+    :param path: path of the file, compressed if it ends in .gz, .bz2 or .xz
+    :param binary: whether to read bytes instead of text
+    :return: file object
+    """
+    for extension, opener in COMPRESSED_OPENERS.items():
+        if path.endswith(extension):
+            return opener(path, 'rb' if binary else 'rt')
+    return open(path, 'rb' if binary else 'r')
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE, binary=False):
+    """
+    Given a file path returns a generator of its text in chunks of at most chunk_size characters, so files of any size
+    can be consumed with bounded memory. Compressed files are decompressed chunk by chunk, as open_input does.
+    :param path: path of the file to read
+    :param chunk_size: maximum amount of characters per chunk, or of bytes if binary
+    :param binary: whether to yield the bytes of the file instead of decoding them, with their line ends translated
+    by translate_newlines
+    :return: generator of text or bytes chunks
+    """
+    with open_input(path, binary) as file:
+        chunks = iter(partial(file.read, chunk_size), b'' if binary else '')
+        if binary:
+            chunks = translate_newlines(chunks)
+        for chunk in chunks:
+            yield chunk
+
+
+def translate_newlines(chunks):
+    """
+    Given chunks of bytes, returns a generator of them with every CR LF pair and every lone CR turned into a LF, as
+    reading text with universal newlines does, so words are separated by the same line ends in bytes as in text. A CR
+    LF pair split between two chunks becomes a single LF too.
+    :param chunks: iterable of bytes
+    :return: generator of bytes
+    """
+    after_cr = False
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if after_cr and chunk.startswith(b'\n'):
+            chunk = chunk[1:]
+        after_cr = chunk.endswith(b'\r')
+        if b'\r' in chunk:
+            chunk = chunk.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        if chunk:
+            yield chunk
+
+
+class ReadAhead:
+    """
+    Reads files in background threads while the ones before them are consumed, so consuming a file does not wait on
+    its I/O, and several files are opened at a time on storage with high latency. At most budget chars, or bytes if
+    binary, of read chunks are held at a time, however many files they belong to, besides one chunk of the file being
+    consumed.
+    Iterating returns a generator of chunks for every file, in order, each of which must be consumed before the next
+    one. Errors reading a file are raised by its generator.
+    """
+    END = object()
+
+    def __init__(self, paths, budget=READ_AHEAD, chunk_size=CHUNK_SIZE, binary=False, threads=READ_AHEAD_THREADS):
+        self.paths = paths
+        self.budget = budget
+        self.chunk_size = max(1, min(chunk_size, budget))
+        self.binary = binary
+        self.threads = threads
+        self.queues = [queue.Queue() for _ in paths]
+        self.file_held = [0] * len(paths)
+        self.held = 0
+        self.next_file = 0
+        self.current_file = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+
+    def __iter__(self):
+        readers = [threading.Thread(target=self.read, daemon=True) for _ in range(min(self.threads, len(self.paths)))]
+        for reader in readers:
+            reader.start()
+        try:
+            for index in range(len(self.paths)):
+                with self.condition:
+                    self.current_file = index
+                    self.condition.notify_all()
+                yield self.file_chunks(index)
+        finally:
+            with self.condition:
+                self.stopped = True
+                self.condition.notify_all()
+            for reader in readers:
+                reader.join()
+
+    def read(self):
+        while True:
+            with self.condition:
+                if self.stopped or self.next_file == len(self.paths):
+                    return
+                index = self.next_file
+                self.next_file += 1
+            try:
+                for chunk in read_chunks(self.paths[index], self.chunk_size, self.binary):
+                    if not self.hold(index, len(chunk)):
+                        return
+                    self.queues[index].put(chunk)
+            except Exception as error:
+                self.queues[index].put(error)
+                continue
+            self.queues[index].put(self.END)
+
+    def hold(self, index, size):
+        # the file being consumed may always hold a chunk, so its reader never waits on the ones reading ahead
+        with self.condition:
+            while not self.stopped and 0 < self.held and self.held + size > self.budget and not (
+                    index == self.current_file and self.file_held[index] == 0):
+                self.condition.wait()
+            if self.stopped:
+                return False
+            self.held += size
+            self.file_held[index] += size
+            return True
+
+    def file_chunks(self, index):
+        chunks = self.queues[index]
+        while True:
+            chunk = chunks.get()
+            if chunk is self.END:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            with self.condition:
+                self.held -= len(chunk)
+                self.file_held[index] -= len(chunk)
+                self.condition.notify_all()
+            yield chunk
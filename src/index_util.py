@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+MANIFEST_VERSION = 1
+
+
+def read_results(path):
+    """
+    Given the path of an index written by write_results, returns its results
+    :param path: index file path
+    :return: dictionary of word to a dictionary of file to count, empty if there is no index in path
+    """
+    results = defaultdict(dict)
+    if not os.path.isfile(path):
+        return results
+    with open(path) as file:
+        lines = [line.rstrip('\n') for line in file]
+    index = 0
+    while index < len(lines):
+        word = lines[index]
+        index += 1
+        while index < len(lines) and lines[index] != '':
+            results[word][lines[index]] = int(lines[index + 1])
+            index += 2
+        index += 1
+    return results
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path, vocabulary):
+    """
+    Given a manifest path and the key of the current vocabulary, returns the manifest file entries
+    :param path: manifest file path
+    :param vocabulary: key of the vocabulary the index has to be built with
+    :return: dictionary of file to [size, mtime, digest] lists, None if the manifest is missing or was written for a
+    different vocabulary
+    """
+    try:
+        with open(path) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('vocabulary') != vocabulary:
+        return None
+    return manifest['files']
+
+
+def save_manifest(path, vocabulary, files):
+    """
+    Saves the manifest of an index
+    :param path: manifest file path
+    :param vocabulary: key of the vocabulary the index was built with
+    :param files: dictionary of file to [size, mtime, digest] lists
+    """
+    temp_path = '{}.tmp'.format(path)
+    with open(temp_path, 'w') as file:
+        json.dump(dict(version=MANIFEST_VERSION, vocabulary=vocabulary, files=files), file)
+    os.replace(temp_path, path)
+
+
+def load_index(index_path, manifest_path, vocabulary):
+    """
+    Loads an index together with its manifest, so unchanged files can be trusted to have their counts in it
+    :param index_path: index file path
+    :param manifest_path: manifest file path
+    :param vocabulary: key of the vocabulary the index has to be built with
+    :return: tuple of the results and the manifest file entries, None if the manifest is missing or was written for a
+    different vocabulary, or the index is missing or can not be read, so every file has to be scanned again
+    """
+    manifest_files = load_manifest(manifest_path, vocabulary)
+    if manifest_files is None or not os.path.isfile(index_path):
+        return None
+    try:
+        return read_results(index_path), manifest_files
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def changed_files(manifest_files, paths):
+    """
+    Given the manifest entries of an index and the paths of the current files, finds what has to be indexed again.
+    Files whose size and mtime did not change are trusted, the rest are only scanned again if their contents did.
+    :param manifest_files: dictionary of file to [size, mtime, digest] lists
+    :param paths: dictionary of current file to its path
+    :return: tuple of files to scan, files no longer present and manifest entries of the current files
+    """
+    to_scan = []
+    entries = dict()
+    for html_file, path in paths.items():
+        stat = os.stat(path)
+        previous = manifest_files.get(html_file)
+        if previous is not None and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns:
+            entries[html_file] = previous
+            continue
+        digest = file_digest(path)
+        entries[html_file] = [stat.st_size, stat.st_mtime_ns, digest]
+        if previous is None or previous[2] != digest:
+            to_scan.append(html_file)
+    removed = [html_file for html_file in manifest_files if html_file not in paths]
+    return to_scan, removed, entries
+
+
+def drop_files(results, html_files):
+    """
+    Removes the counts of the given files from the results, along with the words left without files
+    :param results: dictionary of word to a dictionary of file to count
+    :param html_files: files to remove
+    """
+    html_files = set(html_files)
+    for word in list(results):
+        html_dict = results[word]
+        for html_file in html_files.intersection(html_dict):
+            del html_dict[html_file]
+        if not html_dict:
+            del results[word]
+
+
+def merge_results(results, new_results):
+    """
+    Adds the counts of new_results to results
+    :param results: dictionary of word to a dictionary of file to count, updated in place
+    :param new_results: dictionary of word to a dictionary of file to count
+    """
+    for word, html_dict in new_results.items():
+        results[word].update(html_dict)
@@ -0,0 +1,19 @@
+import argparse
+from binary_index import convert_text_index
+from partial_index import merge_indexes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge partial indexes written by tpe --shard or --file-list')
+    parser.add_argument('output', help='path of the merged index')
+    parser.add_argument('partials', nargs='+', help='partial indexes, a later one wins for files present in several')
+    parser.add_argument('--binary-index', metavar='PATH', help='also write the merged index as a binary index')
+    arguments = parser.parse_args()
+
+    merge_indexes(arguments.partials, arguments.output)
+    if arguments.binary_index is not None:
+        convert_text_index(arguments.output, arguments.binary_index)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import heapq
+import os
+import zlib
+from collections import defaultdict
+from itertools import groupby
+
+MAX_POSTINGS = 1 << 20
+
+
+def shard_of(html_file, shard_count):
+    """
+    Given a file name returns the shard it belongs to, which is the same on every run and machine
+    :param html_file: name of the file
+    :param shard_count: amount of shards
+    :return: shard number, from 0 to shard_count - 1
+    """
+    return zlib.crc32(html_file.encode('utf-8')) % shard_count
+
+
+def iter_index(path):
+    """
+    Given the path of an index written by write_results or by a PartialIndexWriter, returns a generator of its words
+    and postings, reading one word at a time
+    :param path: index file path
+    :return: generator of word - list of file - count tuples
+    """
+    with open(path) as file:
+        word = None
+        postings = []
+        for line in file:
+            line = line.rstrip('\n')
+            if word is None:
+                word = line
+            elif line == '':
+                yield word, postings
+                word = None
+                postings = []
+            else:
+                postings.append((line, int(next(file).rstrip('\n'))))
+        if word is not None:
+            yield word, postings
+
+
+def write_index(entries, path):
+    """
+    Writes words and postings in the format of write_results
+    :param entries: iterable of word - list of file - count tuples
+    :param path: index file path
+    """
+    with open(path, 'w') as file:
+        for word, postings in entries:
+            file.write("{}\n".format(word))
+            for html_file, count in postings:
+                file.write("{}\n".format(html_file))
+                file.write("{}\n".format(count))
+            file.write("\n")
+
+
+def merge_entries(sources):
+    """
+    Given sources of words and postings sorted by word, returns a generator of their merged words and postings, sorted
+    by word and by file. When several sources have counts for the same word and file the last source wins, as in
+    merge_results.
+    :param sources: list of iterables of word - list of file - count tuples, each one sorted by word
+    :return: generator of word - list of file - count tuples
+    """
+    tagged = [((word, number, postings) for word, postings in source) for number, source in enumerate(sources)]
+    for word, group in groupby(heapq.merge(*tagged), key=lambda entry: entry[0]):
+        html_dict = dict()
+        for _, _, postings in group:
+            html_dict.update(postings)
+        yield word, sorted(html_dict.items())
+
+
+def merge_indexes(paths, output_path):
+    """
+    Merges sorted indexes into one sorted index, streaming them so memory does not grow with their size
+    :param paths: paths of indexes sorted by word, like the ones PartialIndexWriter writes
+    :param output_path: path of the merged index
+    """
+    write_index(merge_entries([iter_index(path) for path in paths]), output_path)
+
+
+class PartialIndexWriter:
+    """
+    Writes the counts of a subset of the html files as an index sorted by word and by file, so any amount of them can
+    be merged with merge_indexes. Counts are held in memory until max_postings of them are, and are then spilled to a
+    sorted run file next to the index. Closing the writer merges the runs into the index and removes them.
+    """
+
+    def __init__(self, path, max_postings=MAX_POSTINGS):
+        self.path = path
+        self.max_postings = max_postings
+        self.results = defaultdict(dict)
+        self.postings = 0
+        self.runs = []
+
+    def add(self, html_file, counts):
+        """
+        Adds the counts of a file
+        :param html_file: name of the file
+        :param counts: iterable of word - count tuples
+        """
+        for word, count in counts:
+            self.results[word][html_file] = count
+            self.postings += 1
+        if self.postings >= self.max_postings:
+            self.spill()
+
+    def spill(self):
+        """
+        Writes the counts held in memory to a new run file and forgets them
+        """
+        run_path = '{}.run{}'.format(self.path, len(self.runs))
+        write_index(self.sorted_entries(), run_path)
+        self.runs.append(run_path)
+        self.results = defaultdict(dict)
+        self.postings = 0
+
+    def sorted_entries(self):
+        for word in sorted(self.results):
+            yield word, sorted(self.results[word].items())
+
+    def close(self):
+        """
+        Writes the partial index, merging the runs spilled so far with the counts held in memory
+        """
+        if not self.runs:
+            write_index(self.sorted_entries(), self.path)
+            return
+        if self.results:
+            self.spill()
+        merge_indexes(self.runs, self.path)
+        for run_path in self.runs:
+            os.remove(run_path)
+        self.runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
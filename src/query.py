@@ -0,0 +1,82 @@
+import argparse
+import heapq
+from binary_index import *
+
+
+def lookup(index, term):
+    """
+    Given a binary index and a term, returns the files containing it
+    :param index: BinaryIndex
+    :param term: searched term
+    :return: list of file - count tuples
+    """
+    return [(index.file_name(file_id), count) for file_id, count in index.postings(term)]
+
+
+def query_all(index, terms):
+    """
+    Given a binary index and terms, returns the files containing every term, intersecting their posting lists
+    :param index: BinaryIndex
+    :param terms: searched terms
+    :return: list of file - total count tuples
+    """
+    posting_lists = sorted((index.postings(term) for term in terms), key=len)
+    if not posting_lists:
+        return []
+    totals = dict(posting_lists[0])
+    for postings in posting_lists[1:]:
+        totals = dict((file_id, totals[file_id] + count) for file_id, count in postings if file_id in totals)
+    return [(index.file_name(file_id), count) for file_id, count in sorted(totals.items())]
+
+
+def query_any(index, terms):
+    """
+    Given a binary index and terms, returns the files containing at least one of them, merging their posting lists
+    :param index: BinaryIndex
+    :param terms: searched terms
+    :return: list of file - total count tuples
+    """
+    totals = dict()
+    for term in terms:
+        for file_id, count in index.postings(term):
+            totals[file_id] = totals.get(file_id, 0) + count
+    return [(index.file_name(file_id), count) for file_id, count in sorted(totals.items())]
+
+
+def top_files(matches, amount):
+    """
+    Given query matches returns the amount files with the highest counts
+    :param matches: list of file - count tuples
+    :param amount: amount of files to return
+    :return: list of file - count tuples sorted by count
+    """
+    return heapq.nlargest(amount, matches, key=lambda match: match[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query a binary index written by tpe')
+    parser.add_argument('index')
+    parser.add_argument('terms', nargs='*')
+    parser.add_argument('--any', action='store_true', help='files with any of the terms instead of all of them')
+    parser.add_argument('--top', type=int, help='only show the files with the highest counts')
+    parser.add_argument('--convert', metavar='TEXT_INDEX', help='first build the binary index from a text index')
+    arguments = parser.parse_args()
+
+    if arguments.convert is not None:
+        convert_text_index(arguments.convert, arguments.index)
+    if not arguments.terms:
+        return
+
+    with BinaryIndex(arguments.index) as index:
+        if arguments.any:
+            matches = query_any(index, arguments.terms)
+        else:
+            matches = query_all(index, arguments.terms)
+    if arguments.top is not None:
+        matches = top_files(matches, arguments.top)
+    for html_file, count in matches:
+        print('{} {}'.format(html_file, count))
+
+
+if __name__ == '__main__':
+    main()
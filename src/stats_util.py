@@ -0,0 +1,123 @@
+import json
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from automata_util import get_automata_states, NDState
+
+FileStats = namedtuple('FileStats', 'file chars bytes matches seconds')
+
+
+class RunStats:
+    """
+    Collects the instrumentation of a tpe run: time spent in each phase, automata sizes and per file scan figures.
+    Everything is recorded per phase or per file, never per consumed char.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.phases = dict()
+        self.automata = dict()
+        self.files = []
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager adding the time spent inside it to the given phase
+        :param name: phase name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def count_automata(self, name, automata):
+        """
+        Records the amount of states and transitions of an automata built out of state objects
+        :param name: name to report the automata with
+        :param automata: NDAutomata or Automata
+        """
+        states = get_automata_states(automata)
+        transitions = 0
+        for state in states:
+            for targets in state.transitions.values():
+                transitions += len(targets) if isinstance(state, NDState) else 1
+        self.automata[name] = dict(states=len(states), transitions=transitions)
+
+    def count_table(self, name, automata):
+        """
+        Records the size of a TableAutomata
+        :param name: name to report the automata with
+        :param automata: TableAutomata
+        """
+        self.automata[name] = dict(states=len(automata.table) // automata.class_count,
+                                   char_classes=automata.class_count, transitions=len(automata.table))
+
+    def add_file(self, file_stats):
+        self.files.append(file_stats)
+
+    def report(self, slowest=10):
+        """
+        Returns the collected stats. Scan rates are measured over the wall time of the scan phase, since with several
+        workers the seconds of the files overlap, and file_seconds adds up the time spent scanning each file
+        :param slowest: amount of slowest files to list
+        :return: JSON serializable dictionary
+        """
+        seconds = self.phases.get('scan')
+        file_seconds = sum(file_stats.seconds for file_stats in self.files)
+        chars = sum(file_stats.chars for file_stats in self.files)
+        size = sum(file_stats.bytes for file_stats in self.files)
+        matches = sum(file_stats.matches for file_stats in self.files)
+        return dict(
+            phases=self.phases,
+            automata=self.automata,
+            scan=dict(
+                files=len(self.files),
+                chars=chars,
+                bytes=size,
+                matches=matches,
+                seconds=seconds,
+                file_seconds=file_seconds,
+                chars_per_second=chars / seconds if seconds else None,
+                mb_per_second=size / seconds / 1e6 if seconds else None,
+                matches_per_second=matches / seconds if seconds else None,
+            ),
+            slowest_files=[file_stats._asdict() for file_stats in
+                           sorted(self.files, key=lambda file_stats: file_stats.seconds, reverse=True)[:slowest]],
+            files=[file_stats._asdict() for file_stats in self.files],
+        )
+
+    def write(self, path):
+        """
+        Writes the stats report as JSON
+        :param path: file path, '-' for stderr
+        """
+        if path == '-':
+            json.dump(self.report(), sys.stderr, indent=2)
+            sys.stderr.write('\n')
+        else:
+            with open(path, 'w') as file:
+                json.dump(self.report(), file, indent=2)
+
+
+class NoStats:
+    """
+    Stand in for RunStats when instrumentation is disabled, so callers do not need to check for it.
+    """
+    enabled = False
+
+    def phase(self, name):
+        return nullcontext()
+
+    def count_automata(self, name, automata):
+        pass
+
+    def count_table(self, name, automata):
+        pass
+
+    def add_file(self, file_stats):
+        pass
+
+
+NO_STATS = NoStats()
@@ -1,42 +1,82 @@
 import sys
 import os
+import argparse
+import multiprocessing
+import time
 from automata_util import *
 from file_util import *
-from collections import defaultdict
+from cache_util import *
+from index_util import *
+from binary_index import write_binary_index
+from partial_index import MAX_POSTINGS, PartialIndexWriter, shard_of
+from stats_util import *
+from array import array
+from collections import defaultdict, deque, namedtuple
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+DFA_ENGINE = 'dfa'
+AHO_CORASICK_ENGINE = 'aho-corasick'
+LAZY_DFA_ENGINE = 'lazy-dfa'
+BIT_PARALLEL_ENGINE = 'bit-parallel'
+ENGINES = (DFA_ENGINE, AHO_CORASICK_ENGINE, LAZY_DFA_ENGINE, BIT_PARALLEL_ENGINE)
+UNCOMPILED_ENGINES = (LAZY_DFA_ENGINE, BIT_PARALLEL_ENGINE)
+DISCOVERY_THREADS = 8
+SPARE_ROWS = 64
+HTML_EXTENSIONS = ('.html',) + tuple('.html' + extension for extension in COMPRESSED_OPENERS)
+
+Match = namedtuple('Match', 'file word_id offset line')
 
 
 class WordCounter:
     """
-    Dictionary wrapper that contains words as keys and the number that word appears as values.
-    When adding a word, it returns a function that adds 1 to the number that word appears.
+    Counts the number of times each word appears. Words are identified by the id add_word returns, which is what
+    automata report when reaching an end state.
+    Counts live in a preallocated array and the ids hit since the last reset are kept in order, so resetting and
+    iterating only cost as much as the words found.
     Can be iterated for a word - counter tuple for all words whose counter is greater than 0.
     """
-    def __init__(self):
-        self.counter = defaultdict(int)
+    def __init__(self, words=()):
+        self.words = list(words)
+        self.counter = array('l', [0]) * len(self.words)
+        self.hits = []
 
-    def add_counter(self, word):
+    def add_word(self, word):
         """
-        Adds a word to the dictionary for counting and return a function to update the count number
+        Adds a word for counting and returns its id
         :param word: word to count
-        :return: function that adds 1 to the word counter
+        :return: id of the word
         """
-        def counter_fun():
-            self.counter[word] += 1
+        self.words.append(word)
+        self.counter.append(0)
+        return len(self.words) - 1
 
-        return counter_fun
+    def count_found(self, found):
+        """
+        Adds 1 to the counter of every word found by an automata find_stream, in one loop over all of them
+        :param found: list of offset - word ids tuples
+        :return:
+        """
+        counter = self.counter
+        hits = self.hits
+        for _, word_ids in found:
+            for word_id in word_ids:
+                if counter[word_id] == 0:
+                    hits.append(word_id)
+                counter[word_id] += 1
 
     def reset(self):
         """
         Resets all counters to 0
         :return: 
         """
-        for key in self.counter:
-            self.counter[key] = 0
+        for word_id in self.hits:
+            self.counter[word_id] = 0
+        self.hits = []
 
     def __iter__(self):
-        for word, count in self.counter.items():
-            if count != 0:
-                yield word, count
+        for word_id in self.hits:
+            yield self.words[word_id], self.counter[word_id]
 
 
 def read_words(path):
@@ -48,73 +88,750 @@ def read_words(path):
     return words
 
 
-def build_automata(words):
-    nd_automata = NDAutomata()
+def build_automata(words, engine=DFA_ENGINE):
+    """
+    Builds the non deterministic automata finding the given words, and the word counter counting them
+    :param words: searched words
+    :param engine: engine the automata is built for
+    :return: non deterministic automata - word counter tuple
+    """
+    word_counter = WordCounter()
+    return build_tagged_automata(((word, word) for word in words), engine, word_counter), word_counter
+
+
+def build_vocabularies_automata(vocabularies, engine=DFA_ENGINE):
+    """
+    Builds a non deterministic automata for each of several vocabularies, and a single word counter counting the
+    vocabulary - word tuples of all of them, so a word in several vocabularies is counted once for each one.
+    determinize_vocabularies turns them into deterministic automata, which a LazyProductAutomata runs in one scan, and
+    the results of consume_files are told apart with split_results.
+    :param vocabularies: dictionary of vocabulary name to its searched words
+    :param engine: engine the automata are built for
+    :return: list of non deterministic automata, in the vocabularies order - word counter tuple
+    """
     word_counter = WordCounter()
-    for word in words:
-        fun = word_counter.add_counter(word)
-        nd_automata.add_word(word, fun)
-    return nd_automata, word_counter
+    nd_automatas = [build_tagged_automata(((word, (name, word)) for word in words), engine, word_counter)
+                    for name, words in vocabularies.items()]
+    return nd_automatas, word_counter
+
+
+def build_tagged_automata(entries, engine, word_counter):
+    if engine == AHO_CORASICK_ENGINE:
+        nd_automata = AhoCorasickTrie()
+    else:
+        nd_automata = NDAutomata()
+    with gc_paused():
+        for word, tag in sorted(entries):
+            nd_automata.add_word(word, word_counter.add_word(tag))
+    return nd_automata
+
+
+class EditableVocabulary:
+    """
+    Keeps the compiled automata of a dfa engine vocabulary, and the word counter it reports to, up to date while words
+    are added to it and removed from it. An edit changes the NDAutomata and the DStates of its SubsetConstruction, which
+    only rebuilds the states the edited word reaches, and then patches the rows of those states in the table, which is
+    compiled with spare rows for them. It is only compiled again when they run out, or an edit can not be patched.
+    A removed word keeps its id in the word counter, and gets it back if it is added again, so ids already reported
+    by a scan still name the same word.
+    """
+
+    def __init__(self, words=(), binary=False):
+        self.binary = binary
+        self.word_counter = WordCounter()
+        self.word_ids = dict()
+        self.words = set()
+        nd_automata = NDAutomata()
+        with gc_paused():
+            for word in sorted(set(words)):
+                nd_automata.add_word(word, self.word_id(word))
+                self.words.add(word)
+            self.subset_construction = SubsetConstruction(nd_automata)
+        self.compile()
+
+    def word_id(self, word):
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = self.word_counter.add_word(word)
+            self.word_ids[word] = word_id
+        return word_id
+
+    def compile(self):
+        construction = self.subset_construction
+        spare = len(construction.state_dict) // 8 + SPARE_ROWS
+        self.table_compilation = TableCompilation(construction.automata, self.binary, spare)
+        self.automata = self.table_compilation.automata
+
+    def patch(self):
+        construction = self.subset_construction
+        if not self.table_compilation.patch(construction.changed_key, construction.changed_states,
+                                            construction.evicted_states):
+            self.compile()
+
+    def add_word(self, word):
+        """
+        Adds a word to the vocabulary and patches the automata to find it too
+        :param word: word to be found
+        :return: whether the word was added, False if it already was in the vocabulary
+        """
+        if not word or word in self.words:
+            return False
+        self.subset_construction.add_word(word, self.word_id(word))
+        self.words.add(word)
+        self.patch()
+        return True
+
+    def remove_word(self, word):
+        """
+        Removes a word from the vocabulary and patches the automata to stop finding it
+        :param word: word to stop finding
+        :return: whether the word was removed, False if it was not in the vocabulary
+        """
+        if word not in self.words:
+            return False
+        self.subset_construction.remove_word(word, self.word_ids[word])
+        self.words.remove(word)
+        self.patch()
+        return True
+
+
+def determinize_vocabularies(nd_automatas, engine=DFA_ENGINE):
+    """
+    Given the automata of build_vocabularies_automata, returns the deterministic automata of each of them. Vocabularies
+    are not merged into one automata, since which chars start a word decides what the automata skip, so once compiled
+    they are run together by a LazyProductAutomata, and every vocabulary finds the words a scan of its own finds.
+    :param nd_automatas: non deterministic automata of each vocabulary
+    :param engine: compiled engine the automata were built for
+    :return: list of deterministic automata, in the vocabularies order
+    """
+    return [determinize(nd_automata, engine) for nd_automata in nd_automatas]
+
+
+def split_results(results):
+    """
+    Given the results of scanning with the word counter of build_vocabularies_automata, returns the results of each
+    vocabulary
+    :param results: dictionary of vocabulary - word tuple to a dictionary of file to count
+    :return: dictionary of vocabulary name to a dictionary of word to a dictionary of file to count
+    """
+    vocabulary_results = defaultdict(lambda: defaultdict(dict))
+    for (name, word), html_dict in results.items():
+        vocabulary_results[name][word] = html_dict
+    return vocabulary_results
+
+
+def vocabulary_name(search_file):
+    return os.path.splitext(os.path.basename(search_file))[0]
+
+
+class FileScanner:
+    """
+    Scans html files one at a time with an automata, counting the words it reaches with a word counter.
+    Each scan starts from a clean automata and counter, so a scanner can be shipped once to a worker process and
+    reused for any subset of the files.
+    """
+    def __init__(self, automata, word_counter, directory):
+        self.automata = automata
+        self.word_counter = word_counter
+        self.directory = directory
+        self.last_stats = None
+
+    def scan(self, html_file, chunks=None):
+        """
+        Consumes a whole html file and returns the counts of the words found in it. Its FileStats are left in
+        last_stats.
+        :param html_file: name of the file inside the scanner directory
+        :param chunks: chunks of the file already being read, such as the ones of a ReadAhead, None to read them
+        :return: list of word - count tuples
+        """
+        start = time.perf_counter()
+        path = build_path(self.directory, html_file)
+        if chunks is None:
+            chunks = read_chunks(path, binary=self.automata.binary)
+        count_found = self.word_counter.count_found
+        chars = 0
+        try:
+            for chunk in chunks:
+                chars += len(chunk)
+                count_found(self.automata.find_stream(chunk))
+            count_found(self.automata.find_stream(ENTER.encode('ascii') if self.automata.binary else ENTER))
+            counts = list(self.word_counter)
+        finally:
+            self.word_counter.reset()
+            self.automata.reset()
+        matches = sum(count for _, count in counts)
+        self.last_stats = FileStats(html_file, chars, os.path.getsize(path), matches, time.perf_counter() - start)
+        return counts
+
+    def matches(self, html_file, chunks=None):
+        """
+        Consumes a whole html file and returns a generator of the words found in it, as they are found. Matches are
+        yielded in a batch per chunk of the file, so memory does not grow with its size.
+        The offset of a match is the position right after the found word, counted in bytes by binary automata and in
+        decoded chars otherwise, and its line is the number of the line it is in, from 1.
+        :param html_file: name of the file inside the scanner directory
+        :param chunks: chunks of the file already being read, such as the ones of a ReadAhead, None to read them
+        :return: generator of lists of Match
+        """
+        binary = self.automata.binary
+        if chunks is None:
+            chunks = read_chunks(build_path(self.directory, html_file), binary=binary)
+        enter = ENTER.encode('ascii') if binary else ENTER
+        offset = 0
+        line = 1
+        # a consumer may stop iterating halfway through the file, which must not leave the automata in it
+        try:
+            for chunk in chunks:
+                batch = []
+                last_position = 0
+                for position, word_ids in self.automata.find_stream(chunk):
+                    line += chunk.count(enter, last_position, position)
+                    last_position = position
+                    for word_id in word_ids:
+                        batch.append(Match(html_file, word_id, offset + position, line))
+                line += chunk.count(enter, last_position)
+                offset += len(chunk)
+                if batch:
+                    yield batch
+            batch = [Match(html_file, word_id, offset, line)
+                     for _, word_ids in self.automata.find_stream(enter) for word_id in word_ids]
+        finally:
+            self.automata.reset()
+        if batch:
+            yield batch
+
+
+worker_scanner = None
+
+
+def init_worker(scanner):
+    global worker_scanner
+    worker_scanner = scanner
+
+
+def scan_in_worker(html_file):
+    try:
+        counts = worker_scanner.scan(html_file)
+    except Exception as error:
+        return html_file, error, None
+    return html_file, counts, worker_scanner.last_stats
+
+
+def skip_file(html_file, error, on_error):
+    if on_error is None:
+        raise error
+    on_error(html_file, error)
+
+
+def scan_files(automata, word_counter, directory, html_files, workers=1, stats=NO_STATS, read_ahead=0, on_error=None):
+    """
+    Scans every html file and returns a generator of the counts found in each one, in the given file order.
+    With more than one worker the files are split among worker processes, each one receiving the automata once, so
+    each one waits on the I/O of its files while the others scan. A single process reads the next files ahead in a
+    background thread instead, when given a read ahead budget.
+    :param automata: automata finding the words of the word counter
+    :param word_counter: WordCounter with the words the automata ids refer to
+    :param directory: directory containing the html files
+    :param html_files: names of the files to scan
+    :param workers: amount of processes scanning files
+    :param stats: RunStats receiving the FileStats of every file
+    :param read_ahead: chars, or bytes for binary automata, read ahead of the scanned file, 0 to read files as they
+    are scanned
+    :param on_error: function called with the file and the error of every file that could not be scanned, which is
+    left out of the counts, None to raise the error instead
+    :return: generator of file - list of word - count tuples
+    """
+    scanner = FileScanner(automata, word_counter, directory)
+    if workers > 1 and len(html_files) > 1:
+        chunk_size = max(1, len(html_files) // (workers * 4))
+        with multiprocessing.Pool(workers, init_worker, (scanner,)) as pool:
+            for html_file, counts, file_stats in pool.imap(scan_in_worker, html_files, chunk_size):
+                if file_stats is None:
+                    skip_file(html_file, counts, on_error)
+                    continue
+                stats.add_file(file_stats)
+                yield html_file, counts
+    elif read_ahead > 0:
+        paths = [build_path(directory, html_file) for html_file in html_files]
+        for html_file, chunks in zip(html_files, ReadAhead(paths, read_ahead, binary=automata.binary)):
+            try:
+                counts = scanner.scan(html_file, chunks)
+            except Exception as error:
+                # the chunks left unread still hold part of the read ahead budget
+                try:
+                    for _ in chunks:
+                        pass
+                except Exception:
+                    pass
+                skip_file(html_file, error, on_error)
+                continue
+            stats.add_file(scanner.last_stats)
+            yield html_file, counts
+    else:
+        for html_file in html_files:
+            try:
+                counts = scanner.scan(html_file)
+            except Exception as error:
+                skip_file(html_file, error, on_error)
+                continue
+            stats.add_file(scanner.last_stats)
+            yield html_file, counts
+
+
+def scan_matches(automata, word_counter, directory, html_files, read_ahead=0):
+    """
+    Scans every html file in the given order and returns a generator of the words found in them, as FileScanner.matches
+    does, so positions can be consumed in the same pass that finds them. count_matches turns them into counts.
+    :param automata: automata finding the words of the word counter
+    :param word_counter: WordCounter with the words the automata ids refer to
+    :param directory: directory containing the html files
+    :param html_files: names of the files to scan
+    :param read_ahead: chars, or bytes for binary automata, read ahead of the scanned file, 0 to read files as they
+    are scanned
+    :return: generator of lists of Match
+    """
+    scanner = FileScanner(automata, word_counter, directory)
+    if read_ahead > 0:
+        paths = [build_path(directory, html_file) for html_file in html_files]
+        for html_file, chunks in zip(html_files, ReadAhead(paths, read_ahead, binary=automata.binary)):
+            yield from scanner.matches(html_file, chunks)
+    else:
+        for html_file in html_files:
+            yield from scanner.matches(html_file)
 
 
-def consume_files(automata, word_counter, directory, html_files):
+def count_matches(batches, word_counter):
+    """
+    Given batches of matches returns a dictionary with the files and counts for each found word, as consume_files does
+    :param batches: iterable of lists of Match
+    :param word_counter: WordCounter with the words the match ids refer to
+    :return: dictionary of word to a dictionary of file to count
+    """
+    results = defaultdict(dict)
+    words = word_counter.words
+    for batch in batches:
+        for match in batch:
+            html_dict = results[words[match.word_id]]
+            html_dict[match.file] = html_dict.get(match.file, 0) + 1
+    return results
+
+
+def consume_files(automata, word_counter, directory, html_files, workers=1, stats=NO_STATS, read_ahead=0,
+                  on_error=None):
+    """
+    Scans every html file and returns a dictionary with the files and counts for each found word, as scan_files does.
+    :param automata: automata finding the words of the word counter
+    :param word_counter: WordCounter with the words the automata ids refer to
+    :param directory: directory containing the html files
+    :param html_files: names of the files to scan
+    :param workers: amount of processes scanning files
+    :param stats: RunStats receiving the FileStats of every file
+    :param read_ahead: chars read ahead of the scanned file by a single process, 0 to read files as they are scanned
+    :param on_error: function called with the file and the error of every file that could not be scanned, None to
+    raise the error instead
+    :return: dictionary of word to a dictionary of file to count
+    """
     results = defaultdict(dict)
-    for html_file in html_files:
-        with open(build_path(directory, html_file)) as f:
-            for line in f:
-                automata.consume_stream(line + '\n')
-        for word, count in word_counter:
+    for html_file, counts in scan_files(automata, word_counter, directory, html_files, workers, stats, read_ahead,
+                                        on_error):
+        for word, count in counts:
             results[word][html_file] = count
-        word_counter.reset()
-        automata.reset()
     return results
 
 
 def write_results(results, path):
-    with open(path, 'w') as file:
+    """
+    Writes results as an index, to a temporary file replacing the index once complete, so a failed write never leaves
+    a truncated index behind
+    :param results: dictionary of word to a dictionary of file to count
+    :param path: index file path
+    """
+    temp_path = '{}.tmp'.format(path)
+    with open(temp_path, 'w') as file:
         for word, html_dict in results.items():
             file.write("{}\n".format(word))
             for html_file, count in html_dict.items():
                 file.write("{}\n".format(html_file))
                 file.write("{}\n".format(count))
             file.write("\n")
+    os.replace(temp_path, path)
 
 
 def build_path(directory, file):
     return "{}\{}".format(directory, file)
 
 
+def determinize(nd_automata, engine=DFA_ENGINE):
+    if engine == AHO_CORASICK_ENGINE:
+        with gc_paused():
+            return aho_corasick_automata(nd_automata)
+    return full_determinize(nd_automata)
+
+
+def write_dot(automata, path, arguments):
+    """
+    Writes the graphviz file of an automata, limited to the states the dot arguments select
+    :param automata: NDAutomata or Automata
+    :param path: path of the graphviz file
+    :param arguments: parsed command line arguments
+    """
+    if arguments.dot_words:
+        states = word_path_states(automata, arguments.dot_words)
+    else:
+        states = breadth_first_states(automata, arguments.dot_depth)
+    if arguments.dot_max_states is not None:
+        states = islice(states, arguments.dot_max_states)
+    write_automata(process_states(states), path)
+
+
+def prepare_automata(arguments, directory, search_files, stats=NO_STATS):
+    """
+    Builds the compiled automata for the search files words, writing its graphviz files with --dot, or loads it from
+    the cache directory when it was already built for the same words and options. The graphviz files are written while
+    building, so --dot always builds the automata, and caches it again. The lazy-dfa engine builds its states while
+    scanning and the bit-parallel engine simulates the NFA, so neither is compiled nor cached.
+    With more than one search file each one is a vocabulary named after the file, as in build_vocabularies_automata.
+    :param arguments: parsed command line arguments
+    :param directory: directory where graphviz files are written
+    :param search_files: paths of the files with the searched words
+    :param stats: RunStats timing each phase and counting automata sizes
+    :return: automata - word counter tuple
+    """
+    names = [vocabulary_name(search_file) for search_file in search_files] if len(search_files) > 1 else []
+    cache_file = None
+    if arguments.cache_dir is not None and arguments.engine not in UNCOMPILED_ENGINES:
+        with stats.phase('load_cache'):
+            key = vocabularies_key(search_files, arguments.engine, arguments.minimize, arguments.bytes, *names)
+            cache_file = cache_path(arguments.cache_dir, key)
+            cached = None if arguments.dot else load_automata(cache_file)
+        if cached is not None:
+            automata, words = cached
+            if names:
+                # the flush limit is a scan option, not part of the cache key
+                automata.max_states = arguments.max_states
+                for name, table in zip(names, automata.tables):
+                    stats.count_table('table.{}'.format(name), table)
+            else:
+                stats.count_table('table', automata)
+            return automata, WordCounter(words)
+
+    with stats.phase('read_words'):
+        vocabularies = dict((name, read_words(search_file)) for name, search_file in zip(names, search_files))
+        if not vocabularies:
+            words = read_words(search_files[0])
+
+    if vocabularies:
+        if arguments.engine in UNCOMPILED_ENGINES:
+            raise ValueError('several search files need a compiled engine, not {}'.format(arguments.engine))
+        with stats.phase('build'):
+            nd_automatas, word_counter = build_vocabularies_automata(vocabularies, arguments.engine)
+        if arguments.engine != AHO_CORASICK_ENGINE:
+            for name, nd_automata in zip(names, nd_automatas):
+                stats.count_automata('nfa.{}'.format(name), nd_automata)
+                if arguments.dot:
+                    with stats.phase('write_nfa_dot'):
+                        write_dot(nd_automata, build_path(directory, 'nfa.{}.dot'.format(name)), arguments)
+        with stats.phase('determinize'):
+            d_automatas = determinize_vocabularies(nd_automatas, arguments.engine)
+        tables = [compile_table(arguments, directory, d_automata, 'dfa.{}'.format(name), stats)
+                  for name, d_automata in zip(names, d_automatas)]
+        for name, table in zip(names, tables):
+            stats.count_table('table.{}'.format(name), table)
+        return cache_automata(LazyProductAutomata(tables, arguments.max_states), word_counter, cache_file, stats)
+
+    with stats.phase('build'):
+        nd_automata, word_counter = build_automata(words, arguments.engine)
+    if arguments.engine != AHO_CORASICK_ENGINE:
+        stats.count_automata('nfa', nd_automata)
+        if arguments.dot:
+            with stats.phase('write_nfa_dot'):
+                write_dot(nd_automata, build_path(directory, 'nfa.dot'), arguments)
+    if arguments.engine == LAZY_DFA_ENGINE:
+        with stats.phase('determinize'):
+            return lazy_determinize(nd_automata, arguments.max_states), word_counter
+    if arguments.engine == BIT_PARALLEL_ENGINE:
+        with stats.phase('compile'):
+            return bit_parallel_automata(nd_automata), word_counter
+
+    with stats.phase('determinize'):
+        d_automata = determinize(nd_automata, arguments.engine)
+    return compile_dfa(arguments, directory, d_automata, word_counter, cache_file, stats)
+
+
+def compile_dfa(arguments, directory, d_automata, word_counter, cache_file, stats):
+    """
+    Minimizes a deterministic automata when asked to, writes its graphviz file with --dot, compiles it and caches it
+    :param arguments: parsed command line arguments
+    :param directory: directory where graphviz files are written
+    :param d_automata: deterministic automata finding the words of the word counter
+    :param word_counter: WordCounter with the words the automata ids refer to
+    :param cache_file: path where the compiled automata is cached, None to not cache it
+    :param stats: RunStats timing each phase and counting automata sizes
+    :return: automata - word counter tuple
+    """
+    automata = compile_table(arguments, directory, d_automata, 'dfa', stats)
+    stats.count_table('table', automata)
+    return cache_automata(automata, word_counter, cache_file, stats)
+
+
+def compile_table(arguments, directory, d_automata, name, stats):
+    """
+    Minimizes a deterministic automata when asked to, writes its graphviz file with --dot and compiles it
+    :param arguments: parsed command line arguments
+    :param directory: directory where graphviz files are written
+    :param d_automata: deterministic automata
+    :param name: name the automata is counted and its graphviz file written with
+    :param stats: RunStats timing each phase and counting automata sizes
+    :return: TableAutomata
+    """
+    if arguments.minimize:
+        state_count = len(get_automata_states(d_automata))
+        with stats.phase('minimize'):
+            d_automata = minimize_automata(d_automata)
+        print('Minimized {} from {} to {} states'.format(name, state_count, len(get_automata_states(d_automata))),
+              file=sys.stderr)
+    stats.count_automata(name, d_automata)
+    if arguments.dot:
+        with stats.phase('write_dfa_dot'):
+            write_dot(d_automata, build_path(directory, '{}.dot'.format(name)), arguments)
+
+    with stats.phase('compile'):
+        return compile_byte_automata(d_automata) if arguments.bytes else compile_automata(d_automata)
+
+
+def cache_automata(automata, word_counter, cache_file, stats):
+    """
+    Caches a compiled automata, when a cache file is given
+    :param automata: compiled automata
+    :param word_counter: WordCounter with the words the automata ids refer to
+    :param cache_file: path where the compiled automata is cached, None to not cache it
+    :param stats: RunStats timing each phase and counting automata sizes
+    :return: automata - word counter tuple
+    """
+    if cache_file is not None:
+        with stats.phase('save_cache'):
+            save_automata(cache_file, automata, word_counter.words)
+    return automata, word_counter
+
+
+def list_html_files(directory, recursive=False, threads=DISCOVERY_THREADS):
+    """
+    Given a directory returns the names of the html files in it, compressed ones included. Recursively, the files in
+    its subdirectories are named by their path relative to it, and subdirectories are listed by a pool of threads, so
+    the latency of a network mount is waited on for several of them at a time.
+    :param directory: directory to list
+    :param recursive: whether to list the html files of subdirectories too
+    :param threads: amount of threads listing subdirectories
+    :return: list of file names
+    """
+    html_files, subdirectories = scan_directory(directory, '')
+    if not recursive:
+        return html_files
+    with ThreadPoolExecutor(threads) as executor:
+        pending = deque(executor.submit(scan_directory, directory, subdirectory) for subdirectory in subdirectories)
+        while pending:
+            files, subdirectories = pending.popleft().result()
+            html_files.extend(files)
+            pending.extend(executor.submit(scan_directory, directory, subdirectory) for subdirectory in subdirectories)
+    return html_files
+
+
+def scan_directory(directory, relative_path):
+    """
+    Lists a directory with os.scandir, which knows whether most entries are files without a stat call for each one.
+    Symbolic links to directories are not followed.
+    :param directory: listed root directory
+    :param relative_path: path of the listed directory relative to the root one, '' for the root one
+    :return: tuple of the html file names and the subdirectory names, relative to the root directory
+    """
+    html_files = []
+    subdirectories = []
+    with os.scandir(os.path.join(directory, relative_path)) as entries:
+        for entry in entries:
+            name = os.path.join(relative_path, entry.name) if relative_path else entry.name
+            if entry.is_file():
+                if entry.name.endswith(HTML_EXTENSIONS):
+                    html_files.append(name)
+            elif entry.is_dir(follow_symlinks=False):
+                subdirectories.append(name)
+    return html_files, subdirectories
+
+
+def add_index_arguments(parser):
+    """
+    Adds the command line arguments of every command building an index, which include the ones prepare_automata reads
+    :param parser: ArgumentParser
+    """
+    parser.add_argument('directory')
+    parser.add_argument('search_file')
+    parser.add_argument('--engine', choices=ENGINES, default=DFA_ENGINE)
+    parser.add_argument('--minimize', action='store_true', help='merge equivalent DFA states before scanning')
+    parser.add_argument('--max-states', type=int,
+                        help='states kept by the lazy-dfa engine, or by the product of several search files, before '
+                             'flushing them')
+    parser.add_argument('--bytes', action='store_true',
+                        help='scan the raw UTF-8 bytes of html files, with case folding compiled into the table')
+    parser.add_argument('--workers', type=int, default=1, help='amount of processes scanning html files')
+    parser.add_argument('--recursive', action='store_true',
+                        help='also index the html files in subdirectories, named by their relative path')
+    parser.add_argument('--read-ahead', type=int, default=READ_AHEAD, metavar='CHARS',
+                        help='chars of the next html files read in the background while a single worker scans, 0 to '
+                             'read each file as it is scanned')
+    parser.add_argument('--cache-dir', help='directory where compiled automata are cached by vocabulary')
+    parser.add_argument('--dot', action='store_true', help='write the graphviz files nfa.dot and dfa.dot')
+    parser.add_argument('--dot-depth', type=int, metavar='K',
+                        help='only graph the states at most K transitions away from the init state')
+    parser.add_argument('--dot-max-states', type=int, metavar='N', help='only graph the first N states')
+    parser.add_argument('--dot-word', dest='dot_words', action='append', metavar='WORD',
+                        help='only graph the states consuming WORD, can be given several times')
+
+
+def check_index_arguments(parser, arguments):
+    """
+    Exits through the parser when the arguments added by add_index_arguments do not go together
+    :param parser: ArgumentParser
+    :param arguments: parsed arguments
+    """
+    if arguments.bytes and arguments.engine in UNCOMPILED_ENGINES:
+        parser.error('--bytes needs a compiled engine, not {}'.format(arguments.engine))
+
+
+def shard_argument(value):
+    """
+    Parses a shard given as INDEX/COUNT
+    :param value: command line value
+    :return: shard index - shard count tuple
+    """
+    try:
+        shard_index, shard_count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('shards are given as INDEX/COUNT')
+    if not 0 <= shard_index < shard_count:
+        raise argparse.ArgumentTypeError('the shard index must go from 0 to COUNT - 1')
+    return shard_index, shard_count
+
+
+def read_file_list(path):
+    with open(path) as file:
+        return [line.rstrip('\n') for line in file if line.strip()]
+
+
 def main():
-    arguments = sys.argv
-    if len(arguments) < 3:
+    if len(sys.argv) < 3:
         sys.exit('Not enough arguments given')
 
-    directory = arguments[1]
-    search_file = build_path(directory, arguments[2])
+    parser = argparse.ArgumentParser()
+    add_index_arguments(parser)
+    parser.add_argument('more_search_files', nargs='*', metavar='search_file',
+                        help='more search files whose words are found in the same scan, writing index.NAME.txt for '
+                             'each search file NAME.txt')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only scan html files that changed since the last incremental run')
+    parser.add_argument('--binary-index', action='store_true',
+                        help='also write index.bin, a binary inverted index that query.py reads through mmap')
+    parser.add_argument('--stats', nargs='?', const='-', metavar='PATH',
+                        help='write JSON run stats to PATH, or to stderr when no PATH is given')
+    parser.add_argument('--shard', type=shard_argument, metavar='INDEX/COUNT',
+                        help='only index the html files hashed to shard INDEX of COUNT, writing a partial index')
+    parser.add_argument('--file-list', metavar='PATH',
+                        help='only index the html files named in PATH, one per line, writing a partial index')
+    parser.add_argument('--partial', metavar='PATH',
+                        help='path of the partial index, index.INDEX.part or index.part in the directory by default')
+    parser.add_argument('--max-postings', type=int, default=MAX_POSTINGS,
+                        help='postings a partial index holds in memory before spilling them to disk')
+    arguments = parser.parse_args()
+    check_index_arguments(parser, arguments)
+    partial = arguments.shard is not None or arguments.file_list is not None
+    if partial and (arguments.incremental or arguments.binary_index):
+        parser.error('partial indexes are merged with merge.py, so they can not be incremental nor binary')
+    if arguments.more_search_files and (partial or arguments.incremental):
+        parser.error('several search files can not be indexed incrementally nor into partial indexes')
+    if arguments.more_search_files and arguments.engine in UNCOMPILED_ENGINES:
+        parser.error('several search files need a compiled engine, not {}'.format(arguments.engine))
+    names = [vocabulary_name(name) for name in [arguments.search_file] + arguments.more_search_files]
+    if len(set(names)) < len(names):
+        parser.error('search files must have different names')
+    stats = RunStats() if arguments.stats is not None else NO_STATS
+
+    directory = arguments.directory
+    search_files = [build_path(directory, name) for name in [arguments.search_file] + arguments.more_search_files]
+    search_file = search_files[0]
 
-    if not search_file.endswith('.txt'):
+    if not all(search_file.endswith('.txt') for search_file in search_files):
         sys.exit('Invalid search file')
 
-    html_files = []
+    html_files = list_html_files(directory, arguments.recursive)
+    if arguments.file_list is not None:
+        html_files = read_file_list(arguments.file_list)
+    if arguments.shard is not None:
+        shard_index, shard_count = arguments.shard
+        html_files = [html_file for html_file in html_files if shard_of(html_file, shard_count) == shard_index]
 
-    for file in os.listdir(directory):
-        if os.path.isfile(os.path.join(directory, file)):
-            if file.endswith('.html'):
-                html_files.append(file)
+    index_file = build_path(directory, 'index.txt')
+    manifest_file = build_path(directory, 'index.manifest')
+    if arguments.incremental:
+        with stats.phase('find_changes'):
+            vocabulary = vocabulary_key(search_file, arguments.engine, arguments.bytes)
+            index = load_index(index_file, manifest_file, vocabulary)
+            paths = dict((html_file, build_path(directory, html_file)) for html_file in html_files)
+            if index is None:
+                results = defaultdict(dict)
+                html_files, removed, entries = changed_files(dict(), paths)
+            else:
+                results, manifest_files = index
+                html_files, removed, entries = changed_files(manifest_files, paths)
+                drop_files(results, html_files + removed)
 
-    words = read_words(search_file)
+    automata, word_counter = prepare_automata(arguments, directory, search_files, stats)
+    if partial:
+        partial_file = arguments.partial
+        if partial_file is None:
+            name = 'index.part' if arguments.shard is None else 'index.{}.part'.format(arguments.shard[0])
+            partial_file = build_path(directory, name)
+        writer = PartialIndexWriter(partial_file, arguments.max_postings)
+        with stats.phase('scan'):
+            for html_file, counts in scan_files(automata, word_counter, directory, html_files, arguments.workers,
+                                                stats, arguments.read_ahead):
+                writer.add(html_file, counts)
+        with stats.phase('write_results'):
+            writer.close()
+        if stats.enabled:
+            stats.write(arguments.stats)
+        return
 
-    nd_automata, word_counter = build_automata(words)
-    automata = full_determinize(nd_automata)
+    with stats.phase('scan'):
+        new_results = consume_files(automata, word_counter, directory, html_files, arguments.workers, stats,
+                                    arguments.read_ahead)
 
-    nd_states = process_states(get_automata_states(nd_automata))
-    d_states = process_states(get_automata_states(automata))
+    if len(search_files) > 1:
+        with stats.phase('write_results'):
+            vocabulary_results = split_results(new_results)
+            for name in names:
+                write_results(vocabulary_results[name], build_path(directory, 'index.{}.txt'.format(name)))
+                if arguments.binary_index:
+                    write_binary_index(vocabulary_results[name], build_path(directory, 'index.{}.bin'.format(name)))
+            if os.path.isfile(manifest_file):
+                os.remove(manifest_file)
+        if stats.enabled:
+            stats.write(arguments.stats)
+        return
 
-    write_automata(nd_states, build_path(directory, 'nfa.dot'))
-    write_automata(d_states, build_path(directory, 'dfa.dot'))
+    with stats.phase('write_results'):
+        if arguments.incremental:
+            merge_results(results, new_results)
+        else:
+            results = new_results
+            if os.path.isfile(manifest_file):
+                os.remove(manifest_file)
+        # the manifest vouches for the index, so it is only saved once the index is complete
+        write_results(results, index_file)
+        if arguments.incremental:
+            save_manifest(manifest_file, vocabulary, entries)
+        if arguments.binary_index:
+            write_binary_index(results, build_path(directory, 'index.bin'))
 
-    results = consume_files(automata, word_counter, directory, html_files)
-    write_results(results, build_path(directory, 'index.txt'))
+    if stats.enabled:
+        stats.write(arguments.stats)
 
 
 if __name__ == '__main__':